@@ -6,17 +6,19 @@ from lumibot.backtesting import YahooDataBacktesting
 from lumibot.strategies import Strategy
 from lumibot.entities import Asset
 
+from weekly_cadence import WeeklyCadence
 
-class WeeklyRandomBot(Strategy):
+
+class WeeklyRandomBot(WeeklyCadence, Strategy):
 
     def initialize(self, cash_at_risk: float = 0.2, stock: str = "SPY"):
         self.set_market("stock")
-        self.sleep_time = "1D"  # Still use 1 day to simulate real market days
+        self.sleeptime = "1D"  # Until the first trade, then sleep until the first trading session of the next week
         self.cash_at_risk = cash_at_risk
         self.stock = stock
         self.asset = Asset(symbol=self.stock, asset_type=Asset.AssetType.STOCK)
         self.quote = Asset(symbol="USD", asset_type=Asset.AssetType.FOREX)
-        self.last_trade_week = None  # Keep track of last week we traded
+        self.init_weekly_cadence()  # Keep track of last week we traded
 
     def get_position_size(self):
         cash = self.get_cash()
@@ -31,13 +33,11 @@ class WeeklyRandomBot(Strategy):
 
     def on_trading_iteration(self):
         now = self.get_datetime()
-        current_week = now.isocalendar()[1]  # ISO week number
 
-        if current_week == self.last_trade_week:
+        if not self.is_new_trading_week():
             return  # Skip if we already traded this week
 
         # Proceed with a trade
-        self.last_trade_week = current_week
 
         cash, last_price, quantity = self.get_position_size()
         position = self.get_position(self.asset)
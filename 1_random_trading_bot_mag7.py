@@ -6,14 +6,16 @@ from lumibot.backtesting import YahooDataBacktesting
 from lumibot.strategies import Strategy
 from lumibot.entities import Asset
 
+from weekly_cadence import WeeklyCadence
 
-class Mag7SentimentBot(Strategy):
+
+class Mag7SentimentBot(WeeklyCadence, Strategy):
 
     def initialize(self, cash_at_risk: float = 0.2):
         self.set_market("stock")
-        self.sleep_time = "1D"
+        self.sleeptime = "1D"
         self.cash_at_risk = cash_at_risk
-        self.last_trade_week = None
+        self.init_weekly_cadence()
 
         self.mag7 = [
             "AAPL",  # Apple
@@ -41,13 +43,10 @@ class Mag7SentimentBot(Strategy):
 
     def on_trading_iteration(self):
         now = self.get_datetime()
-        current_week = now.isocalendar()[1]
 
-        if current_week == self.last_trade_week:
+        if not self.is_new_trading_week():
             return
 
-        self.last_trade_week = current_week
-
         sentiments = self.get_sentiments()
 
         best_buy = max(sentiments.items(), key=lambda x: x[1])
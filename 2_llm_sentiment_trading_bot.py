@@ -1,6 +1,6 @@
 from datetime import datetime
 from colorama import Fore
-import random
+import heapq
 
 from lumibot.backtesting import YahooDataBacktesting
 from lumibot.strategies import Strategy
@@ -8,26 +8,19 @@ from lumibot.entities import Asset
 
 # Additional imports for sentiment analysis
 from timedelta import Timedelta
-from langchain_ollama import OllamaLLM
-from ollama import chat
-from pydantic import BaseModel
-import json
 
-from llmprompts import get_web_deets, prompt_template
-
-import yfinance as yf
-
-class Response(BaseModel):
-    sentiment: str
-    score: float
-
-    class Config:
-        schema_extra = {
-            "example": {
-                "sentiment": "positive",
-                "score": 0.2
-            }
-        }
+from sentiment import LLM_CALL_TIMEOUT, MODEL, SentimentEngine, active_prompt_hashes, get_sentiments
+from sentiment_cache import ArticleSentimentCache, SentimentCache
+from sentiment_cascade import SentimentCascade
+from precompute_sentiments import SentimentTable
+from shares_store import SharesStore
+from news_ingestion import NewsIngestor
+from rate_limit import TokenBucket
+from sentiment_workers import SentimentWorkerPool
+from universe import load_universe
+import llmprompts
+from instrumentation import metrics
+from market_snapshot import MarketSnapshot
 
 class Mag7SentimentBot(Strategy):
     """
@@ -35,26 +28,165 @@ class Mag7SentimentBot(Strategy):
     The concept is to do a DCA strategy on the individual stocks in the Magnificent 7 stocks based on the sentiment of the news.
     """
 
-    def initialize(self, cash_at_risk: float = 0.025):
+    def initialize(
+        self,
+        cash_at_risk: float = 0.025,
+        buy_threshold: float = 0.5,
+        sell_threshold: float = -0.8,
+        initial_allocation: float = 0.5,
+        model: str = MODEL,
+        cache_path: str = "sentiment_cache.sqlite",
+        cache_max_entries: int = 50_000,
+        invalidate_cache: bool = False,
+        article_cache_path: str = None,
+        llm_workers: int = None,
+        sentiment_timeout: float = 300,
+        batch_size: int = None,
+        news_token_budget: int = None,
+        keep_alive=-1,
+        ollama_hosts=None,
+        llm_call_timeout: float = LLM_CALL_TIMEOUT,
+        cascade: bool = False,
+        cascade_margin: float = 0.2,
+        cascade_min_confidence: float = 0.6,
+        cascade_audit_rate: float = 0.0,
+        sentiment_table: str = None,
+        ingestion_interval: float = 900,
+        shares_path: str = "shares_store.sqlite",
+        metrics_path: str = None,
+        prometheus_port: int = None,
+        universe=None,
+        top_k: int = None,
+        sentiment_processes: int = None,
+        news_rate_limit: float = None,
+        news_burst: float = None,
+    ):
         """
-        Initializes the bot with a list of the Magnificent 7 stocks and sets the needed parameters.
+        Initializes the bot with its universe of stocks (the Magnificent 7 by default) and sets the needed parameters.
+        The stocks with a sentiment of at least buy_threshold are bought, the ones at or below sell_threshold are sold,
+        and initial_allocation is the portion of the portfolio allocated by market cap in the first week.
+        The LLM sentiments are cached on disk at cache_path, so rerunning the same backtest window skips the LLM.
+        Set cache_path to None to disable the cache, and invalidate_cache to True to drop the cached sentiments
+        that were produced by another model or another version of the prompt template.
+        Set article_cache_path to score every news article on its own and keep its sentiment in the store at that path
+        for good; the sentiment of a stock is then the weighted mean of its articles' sentiments, and only the articles
+        never seen before reach the LLM.
+        The news of all the stocks is fetched concurrently and scored by at most llm_workers concurrent LLM calls
+        (defaults to OLLAMA_NUM_PARALLEL), each stock being given sentiment_timeout seconds.
+        Set batch_size to more than 1 to score the news of up to batch_size stocks in a single LLM call.
+        Set news_token_budget to drop the duplicate news and cut the news of every stock down to about that many tokens
+        before it is put into the prompt.
+        The model is loaded into Ollama once during initialize and kept loaded for keep_alive (-1 for the whole run),
+        so the weekly LLM calls do not pay the model load time.
+        Set ollama_hosts to a list (or a comma separated string) of Ollama servers to spread the LLM calls over them
+        (defaults to OLLAMA_HOSTS, or the single OLLAMA_HOST). Every LLM call is given llm_call_timeout seconds, and a
+        call that is slower than the recent p95 latency is sent again to a second server.
+        Set cascade to True to score the news with a financial lexicon first, and only call the LLM for the stocks whose
+        lexicon score is within cascade_margin of the buy or sell threshold or whose confidence is below
+        cascade_min_confidence. A share cascade_audit_rate of the other stocks is scored by the LLM too, to measure how
+        often both agree on the trade decision.
+        Set sentiment_table to the path of a table written by precompute_sentiments.py to read the sentiments from it
+        instead of calling the LLM during the backtest.
+        When trading live, the news is ingested and scored in the background every ingestion_interval seconds during
+        the week, so the weekly decision only reads the rolling sentiments from memory.
+        The historical shares outstanding used for the market caps are loaded once into the store at shares_path.
+        The stage timings and LLM token metrics of every iteration are appended to metrics_path as JSON lines if it is
+        set (e.g. "metrics.jsonl"), and served as Prometheus text on prometheus_port if it is set.
+        The universe of stocks defaults to the Magnificent 7, and can be any list of symbols or the path of an index file
+        (see universe.load_universe). For a large universe, set top_k to only buy the top_k stocks by sentiment every
+        week, sentiment_processes to score the sentiments on that many worker processes, and news_rate_limit to limit
+        the news API to that many calls per second (bursts of up to news_burst) across all of them.
         """
         self.set_market("stock")
+        metrics.configure(jsonl_path=metrics_path, prometheus_port=prometheus_port)
         self.sleep_time = "1W"
         self.cash_at_risk = cash_at_risk
+        self.buy_threshold = buy_threshold
+        self.sell_threshold = sell_threshold
+        self.initial_allocation = initial_allocation
         self.last_trade_week = None
+        self.trade_count = 0
+        self.submitted_orders = []  # (date, order), for fast_backtest.parity_check
+
+        self.model = model
+        self.llm_workers = llm_workers
+        self.sentiment_timeout = sentiment_timeout
+        self.batch_size = batch_size
+        self.news_token_budget = news_token_budget
+        self.sentiment_table = SentimentTable(sentiment_table) if sentiment_table else None
+        self.sentiment_cache = SentimentCache(cache_path, max_entries=cache_max_entries) if cache_path else None
+        self.article_cache = ArticleSentimentCache(article_cache_path) if article_cache_path else None
+        if self.sentiment_cache is not None and invalidate_cache:
+            removed = self.sentiment_cache.invalidate(
+                self.model,
+                *active_prompt_hashes(self.batch_size, self.news_token_budget, article_level=self.article_cache is not None),
+            )
+            print(Fore.CYAN + f"Invalidated {removed} stale cached sentiments" + Fore.RESET)
+
+        self.sentiment_cascade = None
+        if cascade:
+            self.sentiment_cascade = SentimentCascade(
+                buy_threshold=buy_threshold,
+                sell_threshold=sell_threshold,
+                margin=cascade_margin,
+                min_confidence=cascade_min_confidence,
+                audit_rate=cascade_audit_rate,
+            )
 
-        self.mag7 = [
-            "AAPL",  # Apple
-            "MSFT",  # Microsoft
-            "GOOGL", # Alphabet
-            "AMZN",  # Amazon
-            "META",  # Meta Platforms
-            "NVDA",  # Nvidia
-            "TSLA"   # Tesla
-        ]
-        self.assets = {symbol: Asset(symbol=symbol, asset_type=Asset.AssetType.STOCK) for symbol in self.mag7}
+        # Load the model up front, so the first weekly iteration does not pay for it
+        self.sentiment_engine = None
+        if self.sentiment_table is None:
+            if isinstance(ollama_hosts, str):
+                ollama_hosts = [host.strip() for host in ollama_hosts.split(",") if host.strip()]
+            self.sentiment_engine = SentimentEngine(
+                self.model, keep_alive=keep_alive, timeout=llm_call_timeout, hosts=ollama_hosts
+            )
+            try:
+                print(Fore.CYAN + f"Warmed up {self.model} in {self.sentiment_engine.warm():.1f}s" + Fore.RESET)
+            except Exception as e:
+                print(Fore.YELLOW + f"Warming up {self.model} failed: {e}" + Fore.RESET)
+
+        self.symbols = load_universe(universe)
+        self.top_k = top_k
+        self.assets = {symbol: Asset(symbol=symbol, asset_type=Asset.AssetType.STOCK) for symbol in self.symbols}
         self.quote = Asset(symbol="USD", asset_type=Asset.AssetType.FOREX)
+        self.snapshot = MarketSnapshot(self, self.assets, self.quote)
+
+        # Load the historical shares outstanding over the whole backtest in one go
+        start = self.get_datetime()
+        end = self.broker.data_source.datetime_end if self.is_backtesting else start
+        self.shares_store = SharesStore(shares_path)
+        self.shares_store.load(self.symbols, start, end)
+
+        # Score the sentiments of a large universe on worker processes, with one news rate limit for all of them
+        self.sentiment_pool = None
+        if self.sentiment_table is None and sentiment_processes and sentiment_processes > 1:
+            self.sentiment_pool = SentimentWorkerPool(
+                sentiment_processes,
+                news_rate=news_rate_limit,
+                news_burst=news_burst,
+                model=self.model,
+                cache_path=cache_path,
+                article_cache_path=article_cache_path,
+                llm_workers=llm_workers,
+                timeout=sentiment_timeout,
+                batch_size=batch_size,
+                token_budget=news_token_budget,
+                hosts=ollama_hosts,
+                llm_call_timeout=llm_call_timeout,
+                keep_alive=keep_alive,
+                cascade=self.sentiment_cascade,
+            ).start()
+        elif news_rate_limit:
+            llmprompts.news_rate_limiter = TokenBucket(news_rate_limit, news_burst)
+
+        # Score the news as it comes out during the week when trading live
+        self.news_ingestor = None
+        if not self.is_backtesting and self.sentiment_table is None:
+            self.news_ingestor = NewsIngestor(
+                self.symbols, self.sentiment_engine, poll_interval=ingestion_interval, article_cache=self.article_cache
+            )
+            self.news_ingestor.start()
 
     def get_dates(self):
         """
@@ -70,38 +202,62 @@ class Mag7SentimentBot(Strategy):
         using the get_web_deets function, which is based on the Serper API.
         """
         today, day_prior = self.get_dates()
-        sentiments = {}
 
-        # Iterate through each of the stock symbols in the Magnificent 7 and get the sentiment
-        for symbol in self.mag7:
-            # Collect news data for the stock
-            news = get_web_deets(
-                news_start_date=day_prior,
-                news_end_date=today,
-                stock_name=symbol
-            )
-            
-            # Use the LLM to get the sentiment
-            stream = chat(
-                model="qwen2.5:14b",
-                messages=[
-                    {"role": "user", "content": prompt_template(news)}
-                ],
-                format=Response.model_json_schema()
-            )
+        # Read the precomputed sentiments if there is a sentiment table
+        if self.sentiment_table is not None:
+            scores = self.sentiment_table.get(today)
+            sentiments = {symbol: scores[symbol] for symbol in self.symbols if symbol in scores}
+            if len(sentiments) < len(self.symbols):
+                print(Fore.YELLOW + f"Missing precomputed sentiments for the week of {today}" + Fore.RESET)
+            return sentiments
 
-            result = json.loads(stream["message"]["content"])
-            print(Fore.LIGHTBLUE_EX + f"Sentiment for {symbol}: {result}" + Fore.RESET)
-            sentiments[symbol] = result["score"]
+        # Read the sentiments ingested during the week, only the stocks without any ingested news are scored now
+        sentiments = {}
+        symbols = self.symbols
+        if self.news_ingestor is not None:
+            sentiments = {symbol: result["score"] for symbol, result in self.news_ingestor.sentiments().items()}
+            symbols = [symbol for symbol in self.symbols if symbol not in sentiments]
+            if not symbols:
+                return sentiments
+            print(Fore.YELLOW + f"No ingested news for {symbols}, scoring them now" + Fore.RESET)
+
+        if self.sentiment_pool is not None:
+            results = self.sentiment_pool.score(symbols, day_prior, today)
+            sentiments.update({symbol: result["score"] for symbol, result in results.items()})
+            return sentiments
+
+        # Fetch and score the news of all the stocks concurrently, a stock that fails is left out of this week
+        results = get_sentiments(
+            symbols,
+            news_start_date=day_prior,
+            news_end_date=today,
+            model=self.model,
+            cache=self.sentiment_cache,
+            llm_workers=self.llm_workers,
+            timeout=self.sentiment_timeout,
+            batch_size=self.batch_size,
+            token_budget=self.news_token_budget,
+            engine=self.sentiment_engine,
+            cascade=self.sentiment_cascade,
+            article_cache=self.article_cache,
+        )
+        sentiments.update({symbol: result["score"] for symbol, result in results.items()})
 
         return sentiments
         
+    def submit_order(self, *args, **kwargs):
+        with metrics.stage("submit_order"):
+            order = super().submit_order(*args, **kwargs)
+        self.submitted_orders.append((self.get_datetime(), order))
+        # The order changes the cash and the portfolio value
+        self.snapshot.invalidate()
+        return order
+
     def get_position_size(self, stock_symbol):
         # Get the necessary data for the stock
-        asset = self.assets[stock_symbol]
-        cash = self.get_cash()
-        portfolio = self.get_portfolio_value()
-        last_price = self.get_last_price(asset, quote=self.quote)
+        cash = self.snapshot.cash()
+        portfolio = self.snapshot.portfolio_value()
+        last_price = self.snapshot.price(stock_symbol)
 
         # Calculate the position size based on the cash at risk and portfolio
         if last_price is None or last_price == 0 or cash < 100: # Let there be a buffer of $100
@@ -118,30 +274,35 @@ class Mag7SentimentBot(Strategy):
 
     def get_market_caps(self):
         """
-        Fetches the current market capitalization for each of the Mag7 stocks.
+        Computes the market capitalization for each of the Mag7 stocks as at the current date, using the shares
+        outstanding reported at that date.
         Returns a dictionary with symbols as keys and market caps in billions as values.
         """
         market_caps = {}
+        today = self.get_datetime().strftime("%Y-%m-%d")
         
         # Iterate through each of the stock symbols in the Magnificent 7 and get the market cap
-        for symbol in self.mag7:
+        for symbol in self.symbols:
             # Collect the last price for the stock
-            asset = self.assets[symbol]
-            price = self.get_last_price(asset, quote=self.quote)
+            price = self.snapshot.price(symbol)
 
             # If the price is None or 0, skip to the next stock
             if price is None or price == 0:
                 continue
 
-            # Try to get the market cap from the API    
-            ticker = yf.Ticker(symbol)
-            shares_outstanding = ticker.info.get("sharesOutstanding")
+            # Look up the shares outstanding at the current date
+            shares_outstanding = self.shares_store.shares_as_of(symbol, today)
+            if shares_outstanding is None:
+                print(Fore.YELLOW + f"No shares outstanding known for {symbol}, skipping it" + Fore.RESET)
+                continue
+
             market_cap = price * shares_outstanding / 1_000_000_000  # Convert to billions
             market_caps[symbol] = market_cap
             
         print(Fore.CYAN + f"Market Caps (billions): {market_caps}" + Fore.RESET)
         return market_caps
 
+    @metrics.iteration("on_trading_iteration")
     def on_trading_iteration(self):
         """
         On the first week of the bot investment journey, it is going to allocate the first 50% of the portfolio to the Mag7 stocks based on 
@@ -160,9 +321,10 @@ class Mag7SentimentBot(Strategy):
         now = self.get_datetime()
         current_week = now.isocalendar()[1]
 
-        # Get the portfolio value and cash
-        portfolio_value = self.get_portfolio_value()
-        cash = self.get_cash()
+        # Get the portfolio value and cash, from a fresh snapshot of the market and the account for this iteration
+        self.snapshot.reset()
+        portfolio_value = self.snapshot.portfolio_value()
+        cash = self.snapshot.cash()
         
         # Check if it is the first week
         if self.last_trade_week is None:
@@ -173,8 +335,8 @@ class Mag7SentimentBot(Strategy):
             market_caps = self.get_market_caps()
             total_market_cap = sum(market_caps.values())
 
-            # Allocate 50% of the portfolio to the Mag7 stocks
-            total_allocation = portfolio_value * 0.5
+            # Allocate the initial allocation (50% by default) of the portfolio to the Mag7 stocks
+            total_allocation = portfolio_value * self.initial_allocation
 
             # Iterate through each of the stock symbols in the Magnificent 7 and buy based on market cap
             for symbol, market_cap in market_caps.items():
@@ -183,7 +345,7 @@ class Mag7SentimentBot(Strategy):
                 
                 # Get current price and calculate quantity to buy
                 asset = self.assets[symbol]
-                last_price = self.get_last_price(asset, quote=self.quote)
+                last_price = self.snapshot.price(symbol)
                 
                 if last_price is None or last_price == 0:
                     continue
@@ -217,8 +379,11 @@ class Mag7SentimentBot(Strategy):
 
         # Get the sentiments for the stocks
         sentiments = self.get_sentiments()
-        best_buy = [sentiment for sentiment in sentiments.items() if sentiment[1] >= 0.5]
-        best_sell = [sentiment for sentiment in sentiments.items() if sentiment[1] <= -0.8]
+        best_buy = [sentiment for sentiment in sentiments.items() if sentiment[1] >= self.buy_threshold]
+        if self.top_k:
+            # Only the top_k stocks by sentiment, best first
+            best_buy = heapq.nlargest(self.top_k, best_buy, key=lambda sentiment: sentiment[1])
+        best_sell = [sentiment for sentiment in sentiments.items() if sentiment[1] <= self.sell_threshold]
         buy_symbols, buy_sentiments = [sentiment[0] for sentiment in best_buy], [sentiment[1] for sentiment in best_buy]
         sell_symbols, sell_sentiments = [sentiment[0] for sentiment in best_sell], [sentiment[1] for sentiment in best_sell]
 
@@ -265,6 +430,41 @@ class Mag7SentimentBot(Strategy):
         if not traded_indicator:
             print(Fore.YELLOW + f"No trades executed this week." + Fore.RESET)
 
+    def on_filled_order(self, position, order, price, quantity, multiplier):
+        """
+        Counts the filled orders, which the parameter sweeps report per configuration.
+        """
+        self.trade_count += 1
+
+    def on_strategy_end(self):
+        """
+        Reports how well the sentiment cache was used and how long the LLM calls took during the run.
+        """
+        if self.sentiment_cache is not None:
+            print(Fore.CYAN + f"Sentiment cache: {self.sentiment_cache.stats()}" + Fore.RESET)
+            self.sentiment_cache.close()
+        if self.news_ingestor is not None:
+            self.news_ingestor.stop()
+            print(Fore.CYAN + f"News ingestion: {self.news_ingestor.stats()}" + Fore.RESET)
+        if self.article_cache is not None:
+            print(Fore.CYAN + f"Article sentiment cache: {self.article_cache.stats()}" + Fore.RESET)
+            self.article_cache.close()
+        if self.sentiment_cascade is not None:
+            print(Fore.CYAN + f"Sentiment cascade: {self.sentiment_cascade.stats()}" + Fore.RESET)
+        if self.sentiment_pool is not None:
+            print(Fore.CYAN + f"Sentiment workers: {self.sentiment_pool.stats()}" + Fore.RESET)
+            self.sentiment_pool.close()
+        print(Fore.CYAN + f"Market snapshot: {self.snapshot.stats()}" + Fore.RESET)
+        if self.sentiment_engine is not None:
+            print(Fore.CYAN + f"LLM call latency: {self.sentiment_engine.latency_summary()}" + Fore.RESET)
+            print(Fore.CYAN + f"Ollama endpoints: {self.sentiment_engine.endpoint_stats()}" + Fore.RESET)
+            try:
+                self.sentiment_engine.release()
+            except Exception:
+                pass
+        self.shares_store.close()
+        metrics.print_summary()
+
 if __name__ == "__main__":
     start_date = datetime(2024, 5, 1)
     end_date = datetime(2025, 5, 1)
@@ -0,0 +1,35 @@
+import hashlib
+import re
+
+from news_compaction import DEFAULT_SOURCE_WEIGHT, SOURCE_WEIGHTS, item_text
+
+
+def article_hash(result: dict) -> str:
+    """
+    Returns a short hash of the content of a news item (its title and text, ignoring case, spacing and punctuation),
+    which identifies the article across queries, news windows and the links of its syndicated copies.
+    """
+    text = re.sub(r"[^a-z0-9]+", " ", f"{result.get('title', '')} {item_text(result)}".lower()).strip()
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+
+
+def article_weight(source: str, age_hours: float, half_life_hours: float = 72) -> float:
+    """Weight of an article's sentiment in the aggregate, by its source and its age (halving every half_life_hours)."""
+    return SOURCE_WEIGHTS.get((source or "").strip().lower(), DEFAULT_SOURCE_WEIGHT) * 0.5 ** (max(age_hours, 0) / half_life_hours)
+
+
+def aggregate_sentiment(scored: list) -> dict:
+    """
+    Aggregates the sentiments of the articles of a stock, a list of (weight, score), into the weighted mean score.
+    Returns a dictionary with the keys sentiment, score and articles, or None if there is no article.
+    """
+    total_weight = sum(weight for weight, _ in scored)
+    if not scored or total_weight <= 0:
+        return None
+
+    score = sum(weight * score for weight, score in scored) / total_weight
+    return {
+        "sentiment": "positive" if score >= 0 else "negative",
+        "score": round(score, 4),
+        "articles": len(scored),
+    }
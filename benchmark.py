@@ -0,0 +1,341 @@
+from datetime import datetime, timedelta
+from colorama import Fore
+import argparse
+import subprocess
+import tempfile
+import time
+import json
+import sys
+import os
+
+from fake_servers import FakeOllama, FakeSerper
+from instrumentation import percentile
+
+from universe import MAG7
+
+# What a fresh process imports, by name: the news search, the sentiment pipeline and a sweep worker (which imports the bot)
+IMPORTS = {
+    "import_llmprompts": "import llmprompts",
+    "import_sentiment": "import sentiment",
+    "import_sweep_worker": "from sweep import load_bot_class; load_bot_class()",
+}
+BASELINE_FILE = "benchmark_baseline.json"
+START_DATE = datetime(2024, 5, 1)
+
+# LLM slots of every worker process in the universe scaling benchmark
+UNIVERSE_LLM_WORKERS = 4
+
+
+def summarize(latencies: list, symbols: int, elapsed: float) -> dict:
+    """Returns the p50 and p95 latency (in seconds) and the throughput in symbols per second."""
+    return {
+        "p50": percentile(latencies, 50),
+        "p95": percentile(latencies, 95),
+        "symbols_per_second": symbols / elapsed if elapsed else 0.0,
+    }
+
+
+def start_servers(args):
+    """
+    Starts the fake Serper and Ollama servers, and points the news search and the Ollama client at them. This must run
+    before the first news search and LLM call, as the providers read their endpoints when they are created.
+    """
+    serper = FakeSerper(latency=args.serper_latency, jitter=args.serper_jitter, failure_rate=args.serper_failure_rate, seed=1)
+
+    # The universe scaling benchmark gives every worker process its own LLM slots, the server must serve all of them
+    parallel = args.ollama_parallel
+    if args.universe_sizes:
+        parallel = max(parallel, UNIVERSE_LLM_WORKERS * max(int(n) for n in args.universe_workers.split(",")))
+    ollamas = [
+        FakeOllama(
+            latency=args.ollama_latency,
+            jitter=args.ollama_jitter,
+            failure_rate=args.ollama_failure_rate,
+            tail_rate=args.ollama_tail_rate,
+            tail_latency=args.ollama_tail_latency,
+            parallel=parallel,
+            tokens_per_second=args.tokens_per_second,
+            load_time=args.load_time,
+            seed=2 + i,
+        )
+        for i in range(args.ollama_endpoints)
+    ]
+    serper.start()
+    for ollama in ollamas:
+        ollama.start()
+
+    os.environ["SERPER_BASE_URL"] = serper.url
+    os.environ["OLLAMA_HOST"] = ollamas[0].url
+    os.environ["OLLAMA_HOSTS"] = ",".join(ollama.url for ollama in ollamas)
+    os.environ["OLLAMA_NUM_PARALLEL"] = str(args.ollama_parallel)
+    os.environ["NEWS_STORE_MODE"] = "live"
+    return serper, ollamas
+
+
+def bench_get_web_deets(weeks: int, token_budget: int = None) -> dict:
+    from llmprompts import get_web_deets
+    from precompute_sentiments import weekly_windows
+
+    latencies = []
+    start = time.perf_counter()
+    for day_prior, today in weekly_windows(START_DATE, START_DATE + timedelta(weeks=weeks))[:weeks]:
+        for symbol in MAG7:
+            call_start = time.perf_counter()
+            try:
+                get_web_deets(news_start_date=day_prior, news_end_date=today, stock_name=symbol, token_budget=token_budget)
+            except Exception:
+                continue
+            latencies.append(time.perf_counter() - call_start)
+    return summarize(latencies, len(latencies), time.perf_counter() - start)
+
+
+def bench_get_sentiments(weeks: int, batch_size: int = None, token_budget: int = None) -> dict:
+    from precompute_sentiments import weekly_windows
+    from sentiment import get_engine, get_sentiments
+
+    # Load the model before the timed passes, as the bot does in initialize
+    engine = get_engine()
+    engine.warm()
+
+    latencies = []
+    scored = 0
+    start = time.perf_counter()
+    for day_prior, today in weekly_windows(START_DATE, START_DATE + timedelta(weeks=weeks))[:weeks]:
+        pass_start = time.perf_counter()
+        scored += len(get_sentiments(
+            MAG7, news_start_date=day_prior, news_end_date=today, batch_size=batch_size, token_budget=token_budget
+        ))
+        latencies.append(time.perf_counter() - pass_start)
+    pool = engine.endpoint_stats()
+    engine.pool.close()  # Stop the health checks, the fake servers are stopped before the process exits
+    for endpoint in pool["endpoints"]:
+        print(
+            Fore.CYAN
+            + f"Ollama {endpoint['host']}: {endpoint['calls']} calls, {endpoint['errors']} errors, "
+            + f"{endpoint['timeouts']} timeouts, p50 {endpoint['p50']:.3f}s, p95 {endpoint['p95']:.3f}s"
+            + Fore.RESET
+        )
+    return {
+        **summarize(latencies, scored, time.perf_counter() - start),
+        "cold_starts": engine.cold_starts,
+        "llm_p95": engine.latency_summary()["p95"],
+        "hedged": pool["hedged"],
+        "hedge_wins": pool["hedge_wins"],
+    }
+
+
+def synthetic_prices(symbols: list, start_date: datetime, end_date: datetime, seed: int = 0) -> dict:
+    """Random walk daily prices for the backtest benchmark, a dictionary of symbol to DataFrame."""
+    import numpy as np
+    import pandas as pd
+
+    rng = np.random.default_rng(seed)
+    index = pd.bdate_range(start_date, end_date, tz="America/New_York")
+    prices = {}
+    for i, symbol in enumerate(symbols):
+        close = 100 * (1 + i / 10) * np.exp(np.cumsum(rng.normal(0, 0.01, len(index))))
+        prices[symbol] = pd.DataFrame(
+            {"open": close, "high": close * 1.01, "low": close * 0.99, "close": close, "volume": 1e6},
+            index=index,
+        )
+    return prices
+
+
+def bench_weekly_iteration(weeks: int, batch_size: int = None, token_budget: int = None) -> dict:
+    """Backtests Mag7SentimentBot over synthetic prices and times its weekly iterations (the ones that score news)."""
+    from shares_store import SharesStore
+    from sweep import build_pandas_data, load_bot_class, run_backtest
+
+    end_date = START_DATE + timedelta(weeks=weeks)
+    with tempfile.TemporaryDirectory() as tmp:
+        shares_path = os.path.join(tmp, "shares.sqlite")
+        metrics_path = os.path.join(tmp, "metrics.jsonl")
+
+        shares_store = SharesStore(shares_path)
+        shares_store.load(MAG7, START_DATE, end_date, fetcher=lambda symbol, start, end: [(start, 1e9)])
+        shares_store.close()
+
+        run_backtest(
+            load_bot_class(),
+            build_pandas_data(synthetic_prices(MAG7, START_DATE - timedelta(days=14), end_date + timedelta(days=7))),
+            {
+                "cache_path": None,
+                "shares_path": shares_path,
+                "metrics_path": metrics_path,
+                "batch_size": batch_size,
+                "news_token_budget": token_budget,
+            },
+            START_DATE,
+            end_date,
+        )
+
+        with open(metrics_path) as f:
+            iterations = [json.loads(line) for line in f]
+
+    weekly = [i["stages"]["on_trading_iteration"] for i in iterations if "get_sentiments" in i["stages"]]
+    return summarize(weekly, len(weekly) * len(MAG7), sum(weekly))
+
+
+def import_time(statement: str, repeat: int = 3) -> float:
+    """
+    Runs the statement in a fresh interpreter with python -X importtime, and returns the total import time it reports
+    (the cumulative time of the top level imports, in seconds), the best of repeat runs.
+    """
+    times = []
+    for _ in range(repeat):
+        process = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", statement],
+            capture_output=True,
+            text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        )
+        if process.returncode != 0:
+            raise RuntimeError(f"{statement} failed: {process.stderr.strip().splitlines()[-1]}")
+
+        total = 0
+        for line in process.stderr.splitlines():
+            if not line.startswith("import time:") or "cumulative" in line:
+                continue
+            _, cumulative, name = line[len("import time:"):].split("|")
+            if not name[1:].startswith(" "):
+                total += int(cumulative)
+        times.append(total / 1e6)
+    return min(times)
+
+
+def bench_import_time() -> dict:
+    return {name: {"import_seconds": import_time(statement)} for name, statement in IMPORTS.items()}
+
+
+def bench_universe_scaling(sizes: list, workers: list, weeks: int, news_rate: float = None) -> dict:
+    """
+    Times the weekly sentiment pass of synthetic universes of each size on each number of worker processes. Every
+    worker has UNIVERSE_LLM_WORKERS slots on the fake Ollama server, which is sized for the largest number of workers,
+    so the pass time reflects how the pipeline scales, and not a single saturated server.
+    """
+    from precompute_sentiments import weekly_windows
+    from sentiment_workers import SentimentWorkerPool
+
+    windows = weekly_windows(START_DATE, START_DATE + timedelta(weeks=weeks))[:weeks]
+    results = {}
+    for size in sizes:
+        symbols = [f"SYM{i:03d}" for i in range(size)]
+        for processes in workers:
+            pool = SentimentWorkerPool(processes, news_rate=news_rate, llm_workers=UNIVERSE_LLM_WORKERS).start()
+
+            latencies = []
+            for day_prior, today in windows:
+                pass_start = time.perf_counter()
+                pool.score(symbols, day_prior, today)
+                latencies.append(time.perf_counter() - pass_start)
+            pool.close()
+            results[f"universe_{size}_workers_{processes}"] = summarize(latencies, size * len(windows), sum(latencies))
+    return results
+
+
+def check_regressions(results: dict, baseline: dict, tolerance: float) -> list:
+    """Returns the regressions of the results against the baseline, as messages."""
+    regressions = []
+    for name, result in results.items():
+        if result.get("cold_starts"):
+            regressions.append(f"{name}: {result['cold_starts']} LLM calls had to load the model")
+        if name not in baseline:
+            continue
+        base = baseline[name]
+        if "import_seconds" in result:
+            if result["import_seconds"] > base["import_seconds"] * (1 + tolerance):
+                regressions.append(
+                    f"{name}: {result['import_seconds']:.3f}s is above the baseline {base['import_seconds']:.3f}s"
+                )
+            continue
+        if base["p95"] and result["p95"] > base["p95"] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {result['p95']:.3f}s is above the baseline {base['p95']:.3f}s")
+        if result["symbols_per_second"] < base["symbols_per_second"] * (1 - tolerance):
+            regressions.append(
+                f"{name}: {result['symbols_per_second']:.2f} symbols/s is below the baseline "
+                f"{base['symbols_per_second']:.2f} symbols/s"
+            )
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks of the sentiment pipeline against local fake servers.")
+    parser.add_argument("--weeks", type=int, default=8, help="number of weekly windows per benchmark")
+    parser.add_argument("--batch-size", type=int, default=None)
+    parser.add_argument("--token-budget", type=int, default=None, help="news tokens per symbol put into the prompt")
+    parser.add_argument("--serper-latency", type=float, default=0.2)
+    parser.add_argument("--serper-jitter", type=float, default=0.05)
+    parser.add_argument("--serper-failure-rate", type=float, default=0.0)
+    parser.add_argument("--ollama-latency", type=float, default=1.0)
+    parser.add_argument("--ollama-jitter", type=float, default=0.2)
+    parser.add_argument("--ollama-failure-rate", type=float, default=0.0)
+    parser.add_argument("--ollama-parallel", type=int, default=4)
+    parser.add_argument("--ollama-endpoints", type=int, default=1, help="number of fake Ollama servers to balance over")
+    parser.add_argument("--ollama-tail-rate", type=float, default=0.0, help="share of the LLM calls that are stuck")
+    parser.add_argument("--ollama-tail-latency", type=float, default=10.0, help="extra latency of a stuck LLM call")
+    parser.add_argument("--load-time", type=float, default=5.0, help="simulated model load time of a cold start")
+    parser.add_argument("--tokens-per-second", type=float, default=0.0, help="simulated generation speed, 0 for none")
+    parser.add_argument("--skip-backtest", action="store_true", help="skip the full weekly iteration benchmark")
+    parser.add_argument("--skip-imports", action="store_true", help="skip the import time benchmark")
+    parser.add_argument("--universe-sizes", default="", help="comma separated universe sizes of the scaling benchmark")
+    parser.add_argument("--universe-workers", default="1,2,4", help="comma separated worker process counts")
+    parser.add_argument("--universe-weeks", type=int, default=2, help="number of weekly windows per universe")
+    parser.add_argument("--news-rate", type=float, default=None, help="news API calls per second across the workers")
+    parser.add_argument("--baseline", default=BASELINE_FILE)
+    parser.add_argument("--save-baseline", action="store_true", help="save the results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative regression")
+    args = parser.parse_args()
+
+    # Measured first, in fresh interpreters, so the fake servers' environment does not matter
+    results = {} if args.skip_imports else bench_import_time()
+
+    serper, ollamas = start_servers(args)
+    results.update({
+        "get_web_deets": bench_get_web_deets(args.weeks, args.token_budget),
+        "get_sentiments": bench_get_sentiments(args.weeks, args.batch_size, args.token_budget),
+    })
+    if args.universe_sizes:
+        results.update(bench_universe_scaling(
+            [int(size) for size in args.universe_sizes.split(",")],
+            [int(processes) for processes in args.universe_workers.split(",")],
+            args.universe_weeks,
+            args.news_rate,
+        ))
+    if not args.skip_backtest:
+        results["weekly_iteration"] = bench_weekly_iteration(args.weeks, args.batch_size, args.token_budget)
+    serper.stop()
+    for ollama in ollamas:
+        ollama.stop()
+
+    print(Fore.CYAN + f"{'benchmark':<20}{'p50 s':>10}{'p95 s':>10}{'symbols/s':>12}" + Fore.RESET)
+    for name, result in results.items():
+        if "import_seconds" not in result:
+            print(f"{name:<20}{result['p50']:>10.3f}{result['p95']:>10.3f}{result['symbols_per_second']:>12.2f}")
+    for name, result in results.items():
+        if "import_seconds" in result:
+            print(f"{name:<20}{result['import_seconds']:>10.3f} s import time (python -X importtime)")
+    print(Fore.CYAN + f"Cold starts in the timed LLM calls: {results['get_sentiments']['cold_starts']}" + Fore.RESET)
+    print(
+        Fore.CYAN
+        + f"Hedged LLM calls: {results['get_sentiments']['hedged']} ({results['get_sentiments']['hedge_wins']} won by the hedge), "
+        + f"LLM call p95 {results['get_sentiments']['llm_p95']:.3f}s"
+        + Fore.RESET
+    )
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=4)
+        print(Fore.GREEN + f"Saved the baseline to {args.baseline}" + Fore.RESET)
+        sys.exit(0)
+
+    if not os.path.exists(args.baseline):
+        print(Fore.YELLOW + f"No baseline at {args.baseline}, run with --save-baseline to create one" + Fore.RESET)
+        sys.exit(0)
+
+    with open(args.baseline) as f:
+        regressions = check_regressions(results, json.load(f), args.tolerance)
+    for regression in regressions:
+        print(Fore.RED + regression + Fore.RESET)
+    if regressions:
+        sys.exit(1)
+    print(Fore.GREEN + "No regressions against the baseline" + Fore.RESET)
@@ -0,0 +1,223 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from datetime import datetime, timezone
+import threading
+import hashlib
+import random
+import time
+import json
+
+
+class FakeServer:
+    """
+    A local HTTP server standing in for a remote API in the benchmarks, with a configurable latency, jitter (both in
+    seconds) and failure rate. A share tail_rate of the requests is slowed down by another tail_latency seconds, like
+    a stuck request. Subclasses implement respond, which returns the JSON body of a POST request.
+    """
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        failure_rate: float = 0.0,
+        tail_rate: float = 0.0,
+        tail_latency: float = 0.0,
+        seed: int = None,
+    ):
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.tail_rate = tail_rate
+        self.tail_latency = tail_latency
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.failures = 0
+        self.server = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+                status, payload = server.handle(self.path, body)
+                data = json.dumps(payload).encode("utf-8")
+                try:
+                    self.send_response(status)
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(data)))
+                    self.end_headers()
+                    self.wfile.write(data)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # The client gave up waiting, e.g. on a call that missed its deadline
+
+            def do_GET(self):
+                self.do_POST()
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def handle(self, path: str, body: dict):
+        with self.lock:
+            self.requests += 1
+            delay = max(0.0, self.latency + self.random.uniform(-self.jitter, self.jitter))
+            if self.tail_rate and self.random.random() < self.tail_rate:
+                delay += self.tail_latency
+            failed = self.random.random() < self.failure_rate
+            if failed:
+                self.failures += 1
+
+        time.sleep(delay)
+        if failed:
+            return 500, {"error": "injected failure"}
+        return self.respond(path, body)
+
+    def respond(self, path: str, body: dict):
+        raise NotImplementedError
+
+
+def _seeded(text: str) -> random.Random:
+    # Deterministic per request text, so the same query always gets the same answer
+    return random.Random(int(hashlib.sha256(text.encode("utf-8")).hexdigest()[:16], 16))
+
+
+class FakeSerper(FakeServer):
+    """
+    Stands in for the Serper news API (POST /news). Every query returns `num` news items with deterministic titles and
+    snippets, a share of which are syndicated copies of the same story, as the real news results often are.
+    """
+
+    def __init__(self, duplicate_rate: float = 0.3, **kwargs):
+        super().__init__(**kwargs)
+        self.duplicate_rate = duplicate_rate
+
+    def respond(self, path: str, body: dict):
+        query = body.get("q", "")
+        rng = _seeded(query)
+        stock = query.split(" ")[0]
+        words = ["beats", "misses", "rallies", "slides", "upgrades", "downgrades", "expands", "cuts", "launches", "delays"]
+        sources = ["Reuters", "Bloomberg", "CNBC", "MarketWatch", "Yahoo Finance", "Barron's", "Motley Fool"]
+
+        news = []
+        for i in range(int(body.get("num", 10))):
+            if news and rng.random() < self.duplicate_rate:
+                copy = dict(rng.choice(news))
+                copy["source"] = rng.choice(sources)
+                copy["link"] = f"https://example.com/{stock.lower()}/{i}"
+                news.append(copy)
+                continue
+
+            word = rng.choice(words)
+            news.append({
+                "title": f"{stock} {word} expectations as investors weigh outlook {i}",
+                "link": f"https://example.com/{stock.lower()}/{i}",
+                "snippet": f"{stock} shares {word} after the company reported quarterly results, analysts said. "
+                           f"The stock has moved {rng.uniform(-8, 8):.1f}% this week on volume of {rng.randint(10, 90)}M shares.",
+                "date": f"{rng.randint(1, 6)} days ago",
+                "source": rng.choice(sources),
+                "position": i + 1,
+            })
+        return 200, {"searchParameters": {"q": query, "type": "news"}, "news": news}
+
+
+class FakeOllama(FakeServer):
+    """
+    Stands in for Ollama's /api/chat with structured outputs: the response follows the JSON schema passed as format,
+    either a single {sentiment, score} or a map of stock symbol to {sentiment, score}. At most `parallel` requests are
+    served at once, like OLLAMA_NUM_PARALLEL, and the latency scales with the number of generated tokens. The first
+    request for a model takes load_time seconds longer to load it, as does the first one after it was unloaded with a
+    keep_alive of 0.
+    """
+
+    def __init__(self, parallel: int = 4, tokens_per_second: float = 0.0, load_time: float = 0.0, **kwargs):
+        super().__init__(**kwargs)
+        self.slots = threading.BoundedSemaphore(parallel)
+        self.tokens_per_second = tokens_per_second
+        self.load_time = load_time
+        self.loaded = set()
+
+    def handle(self, path: str, body: dict):
+        with self.slots:
+            return super().handle(path, body)
+
+    def load(self, body: dict) -> float:
+        """Loads or unloads the model of the request, returns the load time in seconds."""
+        model = body.get("model")
+        with self.lock:
+            load_time = 0.0 if model in self.loaded else self.load_time
+            if body.get("keep_alive") in (0, "0", "0s", "0m"):
+                self.loaded.discard(model)
+            else:
+                self.loaded.add(model)
+        time.sleep(load_time)
+        return load_time
+
+    def respond(self, path: str, body: dict):
+        if path.rstrip("/") in ("/api/ps", "/api/tags", "/api/version"):
+            return 200, {"models": [], "version": "0.0.0"}
+
+        load_time = self.load(body) if body.get("model") else 0.0
+        if path.rstrip("/") == "/api/generate":
+            return 200, {
+                "model": body.get("model"),
+                "created_at": datetime.now(timezone.utc).isoformat(),
+                "response": "",
+                "done": True,
+                "load_duration": int(load_time * 1e9),
+                "total_duration": int((self.latency + load_time) * 1e9),
+            }
+
+        prompt = "".join(message.get("content", "") for message in body.get("messages", []))
+        rng = _seeded(prompt)
+        schema = body.get("format") or {}
+        properties = schema.get("properties", {})
+
+        def result():
+            score = round(rng.uniform(-1, 1), 2)
+            return {"sentiment": "positive" if score >= 0 else "negative", "score": score}
+
+        if "score" in properties:
+            content = result()
+        else:
+            content = {symbol: result() for symbol in properties}
+
+        text = json.dumps(content)
+        eval_count = max(1, len(text) // 4)
+        prompt_eval_count = max(1, len(prompt) // 4)
+        eval_seconds = eval_count / self.tokens_per_second if self.tokens_per_second else 0.0
+        time.sleep(eval_seconds)
+
+        return 200, {
+            "model": body.get("model"),
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "message": {"role": "assistant", "content": text},
+            "done": True,
+            "done_reason": "stop",
+            "total_duration": int((self.latency + load_time + eval_seconds) * 1e9),
+            "load_duration": int(load_time * 1e9),
+            "prompt_eval_count": prompt_eval_count,
+            "eval_count": eval_count,
+            "eval_duration": int(max(eval_seconds, 1e-3) * 1e9),
+        }
@@ -0,0 +1,285 @@
+from datetime import datetime
+from colorama import Fore
+import argparse
+import sys
+
+import numpy as np
+import pandas as pd
+
+from precompute_sentiments import MAG7, SentimentTable
+from shares_store import SharesStore
+
+
+def weekly_bars(prices: dict, start_date: datetime, end_date: datetime):
+    """
+    Turns the daily prices of every symbol (a dictionary of symbol to DataFrame with open and close columns) into
+    weekly arrays on the first trading day of every (ISO year, ISO week), which is when the bots trade. As in lumibot's
+    pandas backtests, the first bar is the first one after start_date.
+    Returns the dates and the close and open price arrays of shape (weeks, symbols), NaN where a symbol has no bar.
+    """
+    close = pd.DataFrame({symbol: df["close"] for symbol, df in prices.items()})
+    open_ = pd.DataFrame({symbol: df["open"] for symbol, df in prices.items()})
+    index = pd.DatetimeIndex(close.index)
+    days = index.tz_localize(None) if index.tz is not None else index
+    mask = (days > pd.Timestamp(start_date)) & (days <= pd.Timestamp(end_date))
+
+    calendar = days[mask].isocalendar()
+    first = ~calendar.duplicated(subset=["year", "week"]).to_numpy()
+    rows = np.flatnonzero(mask)[first]
+    return list(days[rows]), close.iloc[rows].to_numpy(dtype=float), open_.iloc[rows].to_numpy(dtype=float)
+
+
+def _forward_fill(prices: np.ndarray) -> np.ndarray:
+    # Carry the last known price forward over the weeks, so missing bars still value the positions
+    valid = np.isfinite(prices)
+    index = np.where(valid, np.arange(prices.shape[0])[:, None], 0)
+    np.maximum.accumulate(index, axis=0, out=index)
+    filled = prices[index, np.arange(prices.shape[1])]
+    return np.where(np.isfinite(filled), filled, 0.0)
+
+
+def run(
+    prices,
+    sentiments,
+    shares,
+    cash: float = 100_000.0,
+    cash_at_risk=0.025,
+    buy_threshold=0.5,
+    sell_threshold=-0.8,
+    initial_allocation=0.5,
+    fill_prices=None,
+    record_trades: bool = True,
+) -> dict:
+    """
+    Replays the rules of Mag7SentimentBot.on_trading_iteration with array operations.
+
+    prices is the last price of every symbol at every weekly decision, of shape (weeks, symbols), and fill_prices the
+    price the orders are filled at (defaults to prices). sentiments is of shape (weeks, symbols), or (runs, weeks,
+    symbols) to replay many runs at once, with NaN where there is no sentiment. shares is the shares outstanding of
+    every symbol at the first week. The strategy parameters are either scalars or arrays of shape (runs,).
+
+    As in the lumibot backtests, the orders of a week are sized with the cash and portfolio value known at the start
+    of the week, since the broker fills them after the iteration.
+
+    Returns a dictionary with the equity curves (runs, weeks), the portfolio values the orders of every week are sized
+    with (runs, weeks), the final cash (runs,) and holdings (runs, symbols), the trade counts (runs,) and, if
+    record_trades is set, the bought and sold quantities (runs, weeks, symbols).
+    """
+    prices = np.asarray(prices, dtype=float)
+    fill_prices = prices if fill_prices is None else np.asarray(fill_prices, dtype=float)
+    sentiments = np.asarray(sentiments, dtype=float)
+    if sentiments.ndim == 2:
+        sentiments = sentiments[None]
+    shares = np.asarray(shares, dtype=float)
+
+    params = [np.atleast_1d(np.asarray(p, dtype=float)) for p in (cash_at_risk, buy_threshold, sell_threshold, initial_allocation)]
+    runs = max(sentiments.shape[0], *(len(p) for p in params))
+    cash_at_risk, buy_threshold, sell_threshold, initial_allocation = (np.broadcast_to(p, (runs,)) for p in params)
+    sentiments = np.broadcast_to(sentiments, (runs,) + prices.shape)
+
+    weeks, symbols = prices.shape
+    marks = _forward_fill(prices)
+    tradable = np.isfinite(prices) & (prices > 0)
+    safe_prices = np.where(tradable, prices, 1.0)
+    safe_fills = np.where(np.isfinite(fill_prices), fill_prices, safe_prices)
+
+    cash_now = np.full(runs, float(cash))
+    holdings = np.zeros((runs, symbols))
+    equity = np.empty((runs, weeks))
+    portfolio_values = np.empty((runs, weeks))
+    trade_count = np.zeros(runs, dtype=int)
+    bought = np.zeros((runs, weeks, symbols)) if record_trades else None
+    sold = np.zeros((runs, weeks, symbols)) if record_trades else None
+
+    # First week: allocate the initial allocation of the portfolio by market cap
+    portfolio_values[:, 0] = cash_now
+    valid = tradable[0] & np.isfinite(shares) & (shares > 0)
+    caps = np.where(valid, safe_prices[0] * np.where(valid, shares, 0.0), 0.0)
+    weights = caps / caps.sum() if caps.sum() > 0 else caps
+    quantity = (cash_now * initial_allocation)[:, None] * weights[None, :] / safe_prices[0]
+    cash_now -= (quantity * safe_fills[0]).sum(axis=1)
+    holdings += quantity
+    trade_count += (quantity > 0).sum(axis=1)
+    if record_trades:
+        bought[:, 0] = quantity
+    equity[:, 0] = cash_now + holdings @ marks[0]
+
+    for week in range(1, weeks):
+        portfolio = cash_now + holdings @ marks[week]
+        portfolio_values[:, week] = portfolio
+        sentiment = sentiments[:, week]
+
+        # get_position_size: cash at risk of the portfolio, or all the cash but a $100 buffer when it is not enough
+        spend = np.where(portfolio * cash_at_risk > cash_now, cash_now - 100, portfolio * cash_at_risk)
+        spend = np.where(cash_now < 100, 0.0, np.maximum(spend, 0.0))
+
+        buy = (sentiment >= buy_threshold[:, None]) & tradable[week] & (spend[:, None] > 0)
+        sell = (sentiment <= sell_threshold[:, None]) & tradable[week] & (holdings > 0)
+
+        buy_quantity = np.where(buy, spend[:, None] / safe_prices[week], 0.0)
+        sell_quantity = np.where(sell, holdings, 0.0)
+
+        cash_now += ((sell_quantity - buy_quantity) * safe_fills[week]).sum(axis=1)
+        holdings += buy_quantity - sell_quantity
+        trade_count += buy.sum(axis=1) + sell.sum(axis=1)
+        if record_trades:
+            bought[:, week] = buy_quantity
+            sold[:, week] = sell_quantity
+        equity[:, week] = cash_now + holdings @ marks[week]
+
+    return {
+        "equity": equity,
+        "portfolio": portfolio_values,
+        "cash": cash_now,
+        "holdings": holdings,
+        "trade_count": trade_count,
+        "bought": bought,
+        "sold": sold,
+    }
+
+
+def summary(equity: np.ndarray, periods_per_year: int = 52) -> dict:
+    """Computes the CAGR, max drawdown and Sharpe ratio of every equity curve of shape (runs, weeks)."""
+    equity = np.atleast_2d(equity)
+    years = max(equity.shape[1] - 1, 1) / periods_per_year
+    cagr = (equity[:, -1] / equity[:, 0]) ** (1 / years) - 1
+    max_drawdown = (1 - equity / np.maximum.accumulate(equity, axis=1)).max(axis=1)
+    returns = np.diff(equity, axis=1) / equity[:, :-1]
+    std = returns.std(axis=1)
+    sharpe = np.where(std > 0, returns.mean(axis=1) / np.where(std > 0, std, 1) * np.sqrt(periods_per_year), 0.0)
+    return {"cagr": cagr, "max_drawdown": max_drawdown, "sharpe": sharpe}
+
+
+def load_inputs(
+    start_date: datetime,
+    end_date: datetime,
+    sentiment_table: str = "sentiments.parquet",
+    prices_dir: str = "prices",
+    symbols: list = MAG7,
+    shares_path: str = "shares_store.sqlite",
+):
+    """
+    Builds the inputs of run from the same data the lumibot backtests use: the daily prices saved by sweep.py, the
+    precomputed sentiment table and the shares outstanding store.
+    Returns the dates, the close and open prices, the sentiments and the shares outstanding.
+    """
+    from sweep import load_prices
+
+    dates, close, open_ = weekly_bars(load_prices(prices_dir, symbols), start_date, end_date)
+
+    table = SentimentTable(sentiment_table)
+    sentiments = np.full(close.shape, np.nan)
+    for week, date in enumerate(dates):
+        scores = table.get(date.strftime("%Y-%m-%d"))
+        sentiments[week] = [scores.get(symbol, np.nan) for symbol in symbols]
+
+    shares_store = SharesStore(shares_path)
+    shares_store.load(symbols, start_date, end_date)
+    shares = np.array([shares_store.shares_as_of(symbol, dates[0].strftime("%Y-%m-%d")) or np.nan for symbol in symbols])
+    shares_store.close()
+    return dates, close, open_, sentiments, shares
+
+
+def parity_check(
+    start_date: datetime,
+    end_date: datetime,
+    sentiment_table: str = "sentiments.parquet",
+    prices_dir: str = "prices",
+    shares_path: str = "shares_store.sqlite",
+    tolerance: float = 1e-6,
+    **parameters,
+) -> bool:
+    """
+    Runs the lumibot backtest of Mag7SentimentBot and the fast engine on the same prices and sentiments, and checks
+    them week by week: the portfolio value at every weekly decision, and the quantity of every symbol bought or sold
+    that week, must be within a relative tolerance of each other. The lumibot backtest sizes the orders with the
+    close and fills them at the open, so the engine is given the opens as fill prices.
+    """
+    from sweep import build_pandas_data, load_bot_class, load_prices, run_backtest
+
+    results, strategy = run_backtest(
+        load_bot_class(),
+        build_pandas_data(load_prices(prices_dir, MAG7)),
+        {**parameters, "sentiment_table": sentiment_table, "shares_path": shares_path},
+        start_date,
+        end_date,
+    )
+
+    dates, close, open_, sentiments, shares = load_inputs(
+        start_date, end_date, sentiment_table, prices_dir, MAG7, shares_path
+    )
+    result = run(close, sentiments, shares, fill_prices=open_, **parameters)
+    index = pd.DatetimeIndex(dates)
+
+    # The portfolio value lumibot recorded at every iteration, on the engine's weekly dates
+    values = strategy.stats["portfolio_value"]
+    values.index = pd.DatetimeIndex(values.index).tz_localize(None).normalize()
+    lumibot_values = values.groupby(level=0).first().reindex(index).to_numpy(dtype=float)
+    fast_values = result["portfolio"][0]
+
+    # The signed quantities of the orders lumibot filled, by the week they were placed in and symbol; an order placed
+    # outside of the weekly dates is a mismatch
+    fills = pd.DataFrame(
+        [
+            (date, order.asset.symbol, float(order.quantity) * (1 if order.is_buy_order() else -1))
+            for date, order in strategy.submitted_orders
+            if order.is_filled()
+        ],
+        columns=["date", "symbol", "quantity"],
+    )
+    fills["date"] = pd.DatetimeIndex(fills["date"]).tz_localize(None).normalize()
+    traded = fills.pivot_table(index="date", columns="symbol", values="quantity", aggfunc="sum")
+    stray = traded.index.difference(index)
+    lumibot_trades = traded.reindex(index=index, columns=MAG7).fillna(0.0).to_numpy()
+    fast_trades = result["bought"][0] - result["sold"][0]
+
+    value_errors = np.abs(lumibot_values - fast_values) / fast_values
+    trade_errors = np.abs(lumibot_trades - fast_trades) / np.maximum(np.abs(fast_trades), 1.0)
+    bad_weeks = np.flatnonzero(~(value_errors <= tolerance) | ~(trade_errors <= tolerance).all(axis=1))
+
+    print(
+        Fore.CYAN
+        + f"Over {len(index)} weeks: lumibot {strategy.trade_count} trades, "
+        + f"fast engine {result['trade_count'][0]} trades, "
+        + f"largest relative difference {np.nanmax(value_errors, initial=0):.2e} in the portfolio values and "
+        + f"{np.nanmax(trade_errors, initial=0):.2e} in the traded quantities"
+        + Fore.RESET
+    )
+    for week in bad_weeks[:5]:
+        print(
+            Fore.RED
+            + f"[{index[week].date()}] portfolio value: lumibot {lumibot_values[week]:.2f}, fast engine "
+            + f"{fast_values[week]:.2f}; trades: lumibot {np.round(lumibot_trades[week], 4).tolist()}, fast engine "
+            + f"{np.round(fast_trades[week], 4).tolist()}"
+            + Fore.RESET
+        )
+    if len(stray):
+        print(Fore.RED + f"Lumibot placed orders outside of the weekly dates: {[d.date() for d in stray]}" + Fore.RESET)
+    return len(bad_weeks) == 0 and len(stray) == 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Vectorized backtest of the Mag7 sentiment strategy.")
+    parser.add_argument("--start", required=True, help="backtesting start date, YYYY-MM-DD")
+    parser.add_argument("--end", required=True, help="backtesting end date, YYYY-MM-DD")
+    parser.add_argument("--sentiment-table", default="sentiments.parquet")
+    parser.add_argument("--prices-dir", default="prices")
+    parser.add_argument("--shares-path", default="shares_store.sqlite")
+    parser.add_argument("--parity", action="store_true", help="check the engine against a lumibot backtest")
+    args = parser.parse_args()
+
+    start_date = datetime.strptime(args.start, "%Y-%m-%d")
+    end_date = datetime.strptime(args.end, "%Y-%m-%d")
+
+    if args.parity:
+        ok = parity_check(start_date, end_date, args.sentiment_table, args.prices_dir, args.shares_path)
+        print((Fore.GREEN + "Parity check passed" if ok else Fore.RED + "Parity check failed") + Fore.RESET)
+        sys.exit(0 if ok else 1)
+
+    dates, close, open_, sentiments, shares = load_inputs(
+        start_date, end_date, args.sentiment_table, args.prices_dir, shares_path=args.shares_path
+    )
+    result = run(close, sentiments, shares)
+    stats = summary(result["equity"])
+    print(Fore.CYAN + f"Final portfolio value: ${result['equity'][0, -1]:.2f} ({result['trade_count'][0]} trades)" + Fore.RESET)
+    print(Fore.CYAN + f"CAGR {stats['cagr'][0]:.2%}, max drawdown {stats['max_drawdown'][0]:.2%}, Sharpe {stats['sharpe'][0]:.2f}" + Fore.RESET)
@@ -0,0 +1,237 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from contextlib import contextmanager
+from collections import defaultdict
+from colorama import Fore
+import functools
+import threading
+import time
+import json
+
+
+def percentile(values: list, q: float) -> float:
+    """Returns the q-th percentile (0 to 100) of the values, using the nearest rank."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(q / 100 * len(ordered)) - 1))]
+
+
+class Instrumentation:
+    """
+    Records the wall time of every stage of the trading iterations (e.g. get_sentiments, the Ollama chat calls,
+    get_last_prices) and the token metrics of the LLM calls. Every iteration is written as one JSON line, the totals can
+    be served as Prometheus text, and a summary table is printed at the end of a backtest.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.durations = defaultdict(list)
+        self.llm_calls = 0
+        self.prompt_tokens = 0
+        self.eval_tokens = 0
+        self.eval_duration = 0.0
+        self.news = defaultdict(int)
+        self.news_symbols = defaultdict(lambda: defaultdict(int))
+        self.iterations = 0
+        self.current = None
+        self.jsonl_path = None
+        self.server = None
+
+    def configure(self, jsonl_path: str = None, prometheus_port: int = None):
+        """Sets the JSONL file the iterations are appended to, and starts the Prometheus endpoint if a port is given."""
+        self.jsonl_path = jsonl_path
+        if prometheus_port and self.server is None:
+            self.serve_prometheus(prometheus_port)
+
+    @contextmanager
+    def stage(self, name: str):
+        """Times the wrapped block as one call of the stage."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def timed(self, name: str):
+        """Decorator version of stage."""
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.stage(name):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def iteration(self, name: str = "on_trading_iteration"):
+        """
+        Decorator for the trading iteration: the stages recorded while it runs are grouped into one JSON line.
+        The decorated method must belong to a Strategy, whose datetime labels the iteration.
+        """
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(strategy, *args, **kwargs):
+                with self.lock:
+                    self.current = {
+                        "datetime": str(strategy.get_datetime()),
+                        "stages": defaultdict(float),
+                        "llm": defaultdict(float),
+                        "news": defaultdict(int),
+                        "news_symbols": defaultdict(lambda: defaultdict(int)),
+                    }
+                try:
+                    with self.stage(name):
+                        return func(strategy, *args, **kwargs)
+                finally:
+                    self._end_iteration()
+            return wrapper
+        return decorator
+
+    def record(self, name: str, seconds: float):
+        with self.lock:
+            self.durations[name].append(seconds)
+            if self.current is not None:
+                self.current["stages"][name] += seconds
+
+    def record_llm(self, stats: dict):
+        """Records the token counts and durations of an Ollama response (see sentiment.llm_stats)."""
+        with self.lock:
+            self.llm_calls += 1
+            self.prompt_tokens += stats["prompt_tokens"]
+            self.eval_tokens += stats["eval_tokens"]
+            self.eval_duration += stats["eval_duration"]
+            if self.current is not None:
+                self.current["llm"]["calls"] += 1
+                for key in ("prompt_tokens", "eval_tokens", "eval_duration"):
+                    self.current["llm"][key] += stats[key]
+
+    def record_news(self, stats: dict, symbol: str = None):
+        """
+        Records the items and tokens of a news payload before and after compaction (see news_compaction.compact_news),
+        and the tokens in and out of the symbol the news is about if one is given.
+        """
+        with self.lock:
+            for key, value in stats.items():
+                self.news[key] += value
+            if self.current is not None:
+                for key, value in stats.items():
+                    self.current["news"][key] += value
+            if symbol is not None:
+                for key in ("tokens_in", "tokens_out"):
+                    self.news_symbols[symbol][key] += stats[key]
+                    if self.current is not None:
+                        self.current["news_symbols"][symbol][key] += stats[key]
+
+    def _end_iteration(self):
+        with self.lock:
+            current, self.current = self.current, None
+            self.iterations += 1
+
+        if self.jsonl_path is None or current is None:
+            return
+
+        llm = dict(current["llm"])
+        if llm.get("eval_duration"):
+            llm["tokens_per_second"] = llm["eval_tokens"] / llm["eval_duration"]
+        record = {"datetime": current["datetime"], "stages": dict(current["stages"]), "llm": llm}
+        if current["news"]:
+            record["news"] = dict(current["news"])
+        if current["news_symbols"]:
+            record["news_symbols"] = {symbol: dict(tokens) for symbol, tokens in current["news_symbols"].items()}
+        with open(self.jsonl_path, "a") as f:
+            f.write(json.dumps(record) + "\n")
+
+    def summary(self) -> dict:
+        """Returns the count, total, mean, p50, p95 and max wall time (in seconds) of every stage."""
+        with self.lock:
+            durations = {name: list(values) for name, values in self.durations.items()}
+        return {
+            name: {
+                "count": len(values),
+                "total": sum(values),
+                "mean": sum(values) / len(values),
+                "p50": percentile(values, 50),
+                "p95": percentile(values, 95),
+                "max": max(values),
+            }
+            for name, values in durations.items()
+        }
+
+    def summary_table(self) -> str:
+        lines = [f"{'stage':<24}{'count':>8}{'total s':>10}{'mean s':>10}{'p50 s':>10}{'p95 s':>10}{'max s':>10}"]
+        for name, row in sorted(self.summary().items(), key=lambda item: -item[1]["total"]):
+            lines.append(
+                f"{name:<24}{row['count']:>8}{row['total']:>10.3f}{row['mean']:>10.3f}"
+                f"{row['p50']:>10.3f}{row['p95']:>10.3f}{row['max']:>10.3f}"
+            )
+        tokens_per_second = self.eval_tokens / self.eval_duration if self.eval_duration else 0.0
+        lines.append(
+            f"LLM: {self.llm_calls} calls, {self.prompt_tokens} prompt tokens, {self.eval_tokens} eval tokens, "
+            f"{tokens_per_second:.1f} tokens/s"
+        )
+        if self.news:
+            saved = 1 - self.news["tokens_out"] / self.news["tokens_in"] if self.news["tokens_in"] else 0.0
+            lines.append(
+                f"News: {self.news['items_in']} items in, {self.news['items_in'] - self.news['items_unique']} duplicates "
+                f"removed, {self.news['items_out']} items out, {self.news['tokens_in']} -> {self.news['tokens_out']} "
+                f"tokens ({saved:.0%} saved)"
+            )
+        return "\n".join(lines)
+
+    def print_summary(self):
+        print(Fore.CYAN + self.summary_table() + Fore.RESET)
+
+    def prometheus_text(self) -> str:
+        """Returns the totals in the Prometheus text exposition format."""
+        lines = [
+            "# TYPE dca_bot_stage_seconds summary",
+        ]
+        for name, row in self.summary().items():
+            lines.append(f'dca_bot_stage_seconds{{stage="{name}",quantile="0.5"}} {row["p50"]}')
+            lines.append(f'dca_bot_stage_seconds{{stage="{name}",quantile="0.95"}} {row["p95"]}')
+            lines.append(f'dca_bot_stage_seconds_sum{{stage="{name}"}} {row["total"]}')
+            lines.append(f'dca_bot_stage_seconds_count{{stage="{name}"}} {row["count"]}')
+        lines += [
+            "# TYPE dca_bot_iterations_total counter",
+            f"dca_bot_iterations_total {self.iterations}",
+            "# TYPE dca_bot_llm_calls_total counter",
+            f"dca_bot_llm_calls_total {self.llm_calls}",
+            "# TYPE dca_bot_llm_prompt_tokens_total counter",
+            f"dca_bot_llm_prompt_tokens_total {self.prompt_tokens}",
+            "# TYPE dca_bot_llm_eval_tokens_total counter",
+            f"dca_bot_llm_eval_tokens_total {self.eval_tokens}",
+            "# TYPE dca_bot_llm_eval_seconds_total counter",
+            f"dca_bot_llm_eval_seconds_total {self.eval_duration}",
+        ]
+        for key, value in self.news.items():
+            lines += [f"# TYPE dca_bot_news_{key}_total counter", f"dca_bot_news_{key}_total {value}"]
+        with self.lock:
+            news_symbols = {symbol: dict(tokens) for symbol, tokens in self.news_symbols.items()}
+        for key in ("tokens_in", "tokens_out"):
+            if news_symbols:
+                lines.append(f"# TYPE dca_bot_news_symbol_{key}_total counter")
+            for symbol, tokens in sorted(news_symbols.items()):
+                lines.append(f'dca_bot_news_symbol_{key}_total{{symbol="{symbol}"}} {tokens[key]}')
+        return "\n".join(lines) + "\n"
+
+    def serve_prometheus(self, port: int):
+        """Serves prometheus_text at http://localhost:port/metrics from a background thread."""
+        instrumentation = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = instrumentation.prometheus_text().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("", port), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+
+# Shared by the bot, the sentiment pipeline and the news search
+metrics = Instrumentation()
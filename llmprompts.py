@@ -1,24 +1,103 @@
-from langchain_ollama import OllamaLLM
-from langchain_community.utilities import GoogleSerperAPIWrapper
-from dotenv import load_dotenv
+from datetime import datetime
 import json
 import os
 
+from instrumentation import metrics
+from news_compaction import compact_news, item_text
+from news_store import NewsStore
+import providers
 
-load_dotenv()
 
-# result_key_for_type="news"
-search = GoogleSerperAPIWrapper(k=15, type="news", serper_api_key=os.getenv("SERPER_API_KEY"))
-llm = OllamaLLM(model="qwen2.5:14b", format="json")
+def create_news_store() -> NewsStore:
+    """
+    Local store of the raw news payloads. NEWS_STORE_MODE is either "live" (no store), "record" (query Serper and write
+    the payloads to the store) or "replay" (serve the recorded payloads without any network access, e.g. in CI).
+    """
+    return NewsStore(os.getenv("NEWS_STORE_PATH", "news_store.sqlite"), mode=os.getenv("NEWS_STORE_MODE", "live"))
 
+
+def create_news_search():
+    """
+    Returns the function that queries the news, search(query, k). It queries the Serper compatible server at
+    SERPER_BASE_URL if it is set (e.g. the fake server of the benchmarks), Serper itself otherwise.
+    """
+    serper_base_url = os.getenv("SERPER_BASE_URL")
+    if serper_base_url:
+        import requests
+
+        session = requests.Session()
+
+        def search(query: str, k: int = 15) -> dict:
+            response = session.post(
+                f"{serper_base_url.rstrip('/')}/news",
+                headers={"X-API-KEY": os.getenv("SERPER_API_KEY") or "", "Content-Type": "application/json"},
+                json={"q": query, "gl": "us", "hl": "en", "num": k},
+                timeout=30,
+            )
+            response.raise_for_status()
+            return response.json()
+        return search
+
+    from langchain_community.utilities import GoogleSerperAPIWrapper
+
+    # result_key_for_type="news"
+    wrapper = GoogleSerperAPIWrapper(k=15, type="news", serper_api_key=os.getenv("SERPER_API_KEY"))
+    return lambda query, k=15: wrapper.results(query)
+
+
+# Created on first use, so importing this module stays cheap for the backtests and worker processes that never search
+providers.register("news_store", create_news_store)
+providers.register("news_search", create_news_search)
+
+# Rate limiter of the news API calls (see rate_limit.TokenBucket), shared by the worker processes that score sentiments
+news_rate_limiter = None
+
+
+def news_query(news_start_date: str, news_end_date: str, stock_name: str) -> str:
+    """Builds the Serper query for the news about the stock within the date window."""
+    return f"{stock_name} price before:{news_end_date} after:{news_start_date}"
+
+
+def search_results(query: str, k: int = 15) -> dict:
+    """Queries Serper for news, or the Serper compatible server at SERPER_BASE_URL if it is set."""
+    if news_rate_limiter is not None:
+        news_rate_limiter.acquire()
+    return providers.get("news_search")(query, k)
+
+
+def get_news_results(news_start_date: str, news_end_date: str, stock_name: str) -> dict:
+    """Returns the raw Serper news payload for the stock, going through the local news store."""
+    return providers.get("news_store").fetch(
+        news_query(news_start_date, news_end_date, stock_name),
+        news_start_date,
+        news_end_date,
+        search_results,
+    )
+
+
+def format_news(results: dict, k: int = 15) -> str:
+    """Joins the snippets of a raw news payload the same way GoogleSerperAPIWrapper.run does."""
+    snippets = [text for text in (item_text(result) for result in results.get("news", [])[:k]) if text]
+
+    if len(snippets) == 0:
+        return "No good Google Search Result was found"
+    return " ".join(snippets)
+
+
+@metrics.timed("get_web_deets")
 def get_web_deets(
-    news_start_date: str, news_end_date: str, stock_name: str = 'MAGNIFICENT 7'
+    news_start_date: str, news_end_date: str, stock_name: str = 'MAGNIFICENT 7', token_budget: int = None
 ) -> str:
-    """Searches the web for news about the stock of MAGNIFICENT 7 as at a specific date."""
-    
-    return search.run(
-        f"{stock_name} price before:{news_end_date} after:{news_start_date}"
-    )
+    """
+    Searches the web for news about the stock of MAGNIFICENT 7 as at a specific date. With a token_budget, the
+    near-duplicate news are removed and only the best ranked news that fit into the budget are kept (see compact_news),
+    their recency measured at the end of the news window rather than today.
+    """
+    results = get_news_results(news_start_date, news_end_date, stock_name)
+    if token_budget is not None:
+        results, stats = compact_news(results, token_budget, now=datetime.strptime(news_end_date, "%Y-%m-%d"))
+        metrics.record_news(stats, stock_name)
+    return format_news(results)
 
 
 def get_detailed_web_deets(
@@ -26,18 +105,16 @@ def get_detailed_web_deets(
 ) -> str:
     """Searches the web for news about the stock as at a specific date."""
     return json.dumps(
-        search.results(
-            f"{stock_name} price before:{news_end_date} after:{news_start_date}"
-        ),
+        get_news_results(news_start_date, news_end_date, stock_name),
         sort_keys=True,
         indent=4,
     )
    
 
 
-def prompt_template(web_deets: str) -> str:
-    """Parses results from a web search into a formatted prompt"""
-    return f"""You are a helpful financial assistant, provide helpful, harmless and honest answers. 
+# The static instructions of the prompts. They go first, in the system message, so every call of a run shares the
+# same prompt prefix and the Ollama server can reuse it from its cache instead of evaluating it again.
+SENTIMENT_INSTRUCTIONS = """You are a helpful financial assistant, provide helpful, harmless and honest answers. 
             Using the news below, respond as to whether the sentiment in the news is either positive or negative by giving a score of 
             how strong the sentiment is between -1 to 1. Negative value indicates negative sentiment of the stock, while
             psoitive value indicates negative sentiment of the stock. Respond using the keys sentiment, score. 
@@ -46,12 +123,57 @@ def prompt_template(web_deets: str) -> str:
             'sentiment':'positive', 
             'score':0.2
 
-            Do not reply with neutral sentiment or mixed. 
+            Do not reply with neutral sentiment or mixed. """
+
+BATCH_SENTIMENT_INSTRUCTIONS = """You are a helpful financial assistant, provide helpful, harmless and honest answers. 
+            Using the news of each stock below, respond as to whether the sentiment in the news is either positive or negative by giving a score of 
+            how strong the sentiment is between -1 to 1. Negative value indicates negative sentiment of the stock, while
+            positive value indicates positive sentiment of the stock. Respond with one result per stock symbol, using the keys sentiment, score. 
+
+            example result
+            'AAPL': {'sentiment':'positive', 'score':0.2}, 
+            'MSFT': {'sentiment':'negative', 'score':-0.4}
+
+            Do not reply with neutral sentiment or mixed, and do not leave out any of the stocks. """
+
+
+def batch_news(news_by_symbol: dict) -> str:
+    """Joins the web search results of several stocks, each under its stock symbol"""
+    return "\n\n            ".join(f"{symbol}\n            {web_deets}" for symbol, web_deets in news_by_symbol.items())
+
+
+def prompt_template(web_deets: str) -> str:
+    """Parses results from a web search into a formatted prompt"""
+    return f"""{SENTIMENT_INSTRUCTIONS}
                 
             News
             {web_deets}"""
 
 
+def batch_prompt_template(news_by_symbol: dict) -> str:
+    """Parses the web search results of several stocks into one formatted prompt, scored per stock"""
+    return f"""{BATCH_SENTIMENT_INSTRUCTIONS}
+                
+            News
+            {batch_news(news_by_symbol)}"""
+
+
+def sentiment_messages(web_deets: str) -> list:
+    """Splits the prompt into chat messages, the static instructions first and the news last"""
+    return [
+        {"role": "system", "content": SENTIMENT_INSTRUCTIONS},
+        {"role": "user", "content": f"News\n{web_deets}"},
+    ]
+
+
+def batch_sentiment_messages(news_by_symbol: dict) -> list:
+    """Splits the batched prompt into chat messages, the static instructions first and the news last"""
+    return [
+        {"role": "system", "content": BATCH_SENTIMENT_INSTRUCTIONS},
+        {"role": "user", "content": f"News\n{batch_news(news_by_symbol)}"},
+    ]
+
+
 def direct_recommendation(web_deets: str) -> str:
     """Parses results from a web search into a formatted prompt"""
     return f"""You are a helpful financial assistant, provide helpful, harmless and honest answers. 
@@ -67,10 +189,11 @@ def direct_recommendation(web_deets: str) -> str:
 
 
 if __name__ == "__main__":
+    from sentiment import SentimentEngine
+
     result = get_detailed_web_deets("2023-08-04", "2023-08-05", "AAPL")
     print(result)
-    res = llm.invoke(prompt_template(result))
-    res = json.loads(res)
+    res = SentimentEngine().score_news(result)
     print(res.keys())
     print(res["sentiment"])
     print(res["score"])
@@ -0,0 +1,58 @@
+from instrumentation import metrics
+
+
+class MarketSnapshot:
+    """
+    The market data and account values of one trading iteration, shared by all the helpers of the strategy instead of
+    each asking the broker again: the last prices of the whole universe (one batched get_last_prices call), the cash
+    and the portfolio value, each fetched on first use.
+
+    Call reset at the start of every iteration, and invalidate after every submitted order, which drops the cash and
+    the portfolio value; the prices are the market data of the iteration and are kept until the next reset.
+    The snapshot counts the lookups it served and the framework calls it made, the difference being the calls avoided.
+    """
+
+    def __init__(self, strategy, assets: dict, quote=None):
+        self.strategy = strategy
+        self.assets = assets
+        self.quote = quote
+        self.lookups = 0
+        self.calls = 0
+        self.reset()
+
+    def reset(self):
+        self._prices = None
+        self._cash = None
+        self._portfolio_value = None
+
+    def invalidate(self):
+        self._cash = None
+        self._portfolio_value = None
+
+    def price(self, symbol: str):
+        """Returns the last price of the symbol, None if it has none."""
+        self.lookups += 1
+        if self._prices is None:
+            self.calls += 1
+            with metrics.stage("get_last_prices"):
+                prices = self.strategy.get_last_prices(list(self.assets.values()), quote=self.quote)
+            self._prices = {asset.symbol: price for asset, price in prices.items()}
+        return self._prices.get(symbol)
+
+    def cash(self) -> float:
+        self.lookups += 1
+        if self._cash is None:
+            self.calls += 1
+            self._cash = self.strategy.get_cash()
+        return self._cash
+
+    def portfolio_value(self) -> float:
+        self.lookups += 1
+        if self._portfolio_value is None:
+            self.calls += 1
+            self._portfolio_value = self.strategy.get_portfolio_value()
+        return self._portfolio_value
+
+    def stats(self) -> dict:
+        # Without the snapshot, every lookup is a framework call
+        return {"lookups": self.lookups, "framework_calls": self.calls, "calls_avoided": self.lookups - self.calls}
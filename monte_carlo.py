@@ -0,0 +1,229 @@
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from colorama import Fore
+import argparse
+import time
+import os
+
+import numpy as np
+import pandas as pd
+
+from fast_backtest import _forward_fill, load_inputs, run, weekly_bars
+from universe import MAG7
+
+# The symbols traded by the random bots, 0_random_trading_bot.py (WeeklyRandomBot) and 1_random_trading_bot_mag7.py
+BOT_SYMBOLS = {0: ["SPY"], 1: MAG7}
+PERCENTILES = (5, 25, 50, 75, 95)
+CHUNK_SIZE = 1000
+
+
+def random_orders(bot: int, seeds, weeks: int, symbols: int):
+    """
+    Draws the weekly decisions of the random bot for every seed, each seed with its own generator so that a seed gives
+    the same run whichever chunk or process it is simulated in. Returns the index of the symbol to buy and of the
+    symbol to sell of every run and week, of shape (runs, weeks), -1 when there is none.
+
+    WeeklyRandomBot.decide_action picks one of buy, sell or hold. Mag7SentimentBot.get_sentiments draws a uniform
+    sentiment in [-1, 1] for every symbol, buys the best one if it is positive and sells the worst one if it is negative.
+    """
+    generators = [np.random.default_rng(seed) for seed in seeds]
+    if bot == 0:
+        actions = np.stack([rng.integers(0, 3, weeks) for rng in generators])
+        return np.where(actions == 0, 0, -1), np.where(actions == 1, 0, -1)
+
+    sentiments = np.stack([rng.uniform(-1, 1, (weeks, symbols)) for rng in generators])
+    buy = np.where(sentiments.max(axis=2) > 0, sentiments.argmax(axis=2), -1)
+    sell = np.where(sentiments.min(axis=2) < 0, sentiments.argmin(axis=2), -1)
+    return buy, sell
+
+
+def simulate(prices, fill_prices, buy, sell, cash: float = 100_000.0, cash_at_risk: float = 0.2) -> dict:
+    """
+    Replays the orders of the random bots for many runs at once over shared price arrays.
+
+    prices is the last price of every symbol at every weekly decision, of shape (weeks, symbols), and fill_prices the
+    price the orders are filled at. buy and sell are the symbol indices returned by random_orders, of shape
+    (runs, weeks). A buy spends cash_at_risk of the cash, a sell closes the whole position, and neither is placed when
+    the symbol has no price that week. As in fast_backtest.run, the orders are sized at the start of the week.
+
+    Returns a dictionary with the equity curves (runs, weeks) and the trade counts (runs,).
+    """
+    prices = np.asarray(prices, dtype=float)
+    fill_prices = np.asarray(fill_prices, dtype=float)
+    buy = np.asarray(buy)
+    sell = np.asarray(sell)
+    runs, weeks = buy.shape
+
+    marks = _forward_fill(prices)
+    tradable = np.isfinite(prices) & (prices > 0)
+    safe_prices = np.where(tradable, prices, 1.0)
+    safe_fills = np.where(np.isfinite(fill_prices), fill_prices, safe_prices)
+
+    rows = np.arange(runs)
+    cash_now = np.full(runs, float(cash))
+    holdings = np.zeros((runs, prices.shape[1]))
+    equity = np.empty((runs, weeks))
+    trade_count = np.zeros(runs, dtype=int)
+
+    for week in range(weeks):
+        buy_symbol = np.maximum(buy[:, week], 0)
+        sell_symbol = np.maximum(sell[:, week], 0)
+
+        buying = (buy[:, week] >= 0) & tradable[week, buy_symbol] & (cash_now > 0)
+        selling = (sell[:, week] >= 0) & tradable[week, sell_symbol] & (holdings[rows, sell_symbol] > 0)
+
+        buy_quantity = np.where(buying, cash_now * cash_at_risk / safe_prices[week, buy_symbol], 0.0)
+        sell_quantity = np.where(selling, holdings[rows, sell_symbol], 0.0)
+
+        cash_now += sell_quantity * safe_fills[week, sell_symbol] - buy_quantity * safe_fills[week, buy_symbol]
+        holdings[rows, sell_symbol] -= sell_quantity
+        holdings[rows, buy_symbol] += buy_quantity
+        trade_count += buying + selling
+        equity[:, week] = cash_now + holdings @ marks[week]
+
+    return {"equity": equity, "trade_count": trade_count}
+
+
+_prices = None
+_fill_prices = None
+
+
+def _init_worker(prices: np.ndarray, fill_prices: np.ndarray):
+    # Runs once per worker process: keep the shared price arrays, instead of sending them with every chunk
+    global _prices, _fill_prices
+    _prices, _fill_prices = prices, fill_prices
+
+
+def _simulate_chunk(bot: int, seeds: range, cash: float, cash_at_risk: float) -> dict:
+    buy, sell = random_orders(bot, seeds, *_prices.shape)
+    return simulate(_prices, _fill_prices, buy, sell, cash, cash_at_risk)
+
+
+def monte_carlo(
+    bot: int,
+    prices,
+    fill_prices,
+    seeds: int = 10_000,
+    first_seed: int = 0,
+    cash: float = 100_000.0,
+    cash_at_risk: float = 0.2,
+    processes: int = None,
+    chunk_size: int = CHUNK_SIZE,
+) -> dict:
+    """
+    Simulates the random bot over the seeds first_seed to first_seed + seeds. The seeds are split into chunks of
+    chunk_size that are simulated together with array operations, on a process pool when there is more than one chunk.
+    Returns a dictionary with the equity curves (seeds, weeks) and the trade counts (seeds,).
+    """
+    chunks = [range(start, min(start + chunk_size, first_seed + seeds)) for start in range(first_seed, first_seed + seeds, chunk_size)]
+    args = (np.asarray(prices, dtype=float), np.asarray(fill_prices, dtype=float))
+    processes = min(processes or os.cpu_count(), len(chunks))
+
+    if processes <= 1:
+        _init_worker(*args)
+        results = [_simulate_chunk(bot, chunk, cash, cash_at_risk) for chunk in chunks]
+    else:
+        with ProcessPoolExecutor(max_workers=processes, initializer=_init_worker, initargs=args) as executor:
+            futures = [executor.submit(_simulate_chunk, bot, chunk, cash, cash_at_risk) for chunk in chunks]
+            results = [future.result() for future in futures]
+
+    return {
+        "equity": np.concatenate([result["equity"] for result in results]),
+        "trade_count": np.concatenate([result["trade_count"] for result in results]),
+    }
+
+
+def percentile_bands(equity: np.ndarray, dates: list, percentiles=PERCENTILES) -> pd.DataFrame:
+    """Returns the percentiles and the mean of the equity curves at every week, one column per percentile."""
+    bands = pd.DataFrame(np.percentile(equity, percentiles, axis=0).T, index=pd.DatetimeIndex(dates, name="date"))
+    bands.columns = [f"p{p}" for p in percentiles]
+    bands["mean"] = equity.mean(axis=0)
+    return bands
+
+
+def plot_bands(bands: pd.DataFrame, path: str, title: str):
+    """Plots the percentile bands, the median and the LLM bot's curve if the bands have one, to an image at path."""
+    import matplotlib
+
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    percentiles = [int(column[1:]) for column in bands.columns if column.startswith("p")]
+    fig, ax = plt.subplots(figsize=(10, 5))
+    for low, high in zip(percentiles, reversed(percentiles)):
+        if low >= high:
+            break
+        ax.fill_between(bands.index, bands[f"p{low}"], bands[f"p{high}"], color="tab:blue", alpha=0.2, label=f"p{low}-p{high}")
+    if 50 in percentiles:
+        ax.plot(bands.index, bands["p50"], color="tab:blue", label="median")
+    if "llm" in bands:
+        ax.plot(bands.index, bands["llm"], color="tab:red", label="LLM bot")
+    ax.set_title(title)
+    ax.set_ylabel("Portfolio value ($)")
+    ax.legend(loc="upper left")
+    fig.tight_layout()
+    fig.savefig(path)
+    plt.close(fig)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Monte Carlo of the random baseline bots over many seeds.")
+    parser.add_argument("--bot", type=int, choices=sorted(BOT_SYMBOLS), default=1, help="0 for WeeklyRandomBot, 1 for the random Mag7 bot")
+    parser.add_argument("--start", required=True, help="backtesting start date, YYYY-MM-DD")
+    parser.add_argument("--end", required=True, help="backtesting end date, YYYY-MM-DD")
+    parser.add_argument("--seeds", type=int, default=10_000)
+    parser.add_argument("--first-seed", type=int, default=0)
+    parser.add_argument("--cash", type=float, default=100_000.0)
+    parser.add_argument("--cash-at-risk", type=float, default=0.2)
+    parser.add_argument("--stock", default="SPY", help="the stock of WeeklyRandomBot")
+    parser.add_argument("--prices-dir", default="prices")
+    parser.add_argument("--processes", type=int, default=None)
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    parser.add_argument("--sentiment-table", help="also replay the LLM bot with this sentiment table to compare it with the bands")
+    parser.add_argument("--out", default="monte_carlo_bands.csv")
+    parser.add_argument("--plot", help="save a plot of the bands to this image")
+    args = parser.parse_args()
+
+    from sweep import load_prices
+
+    start_date = datetime.strptime(args.start, "%Y-%m-%d")
+    end_date = datetime.strptime(args.end, "%Y-%m-%d")
+    symbols = [args.stock] if args.bot == 0 else BOT_SYMBOLS[args.bot]
+    dates, close, open_ = weekly_bars(load_prices(args.prices_dir, symbols), start_date, end_date)
+
+    started = time.perf_counter()
+    result = monte_carlo(
+        args.bot,
+        close,
+        open_,
+        seeds=args.seeds,
+        first_seed=args.first_seed,
+        cash=args.cash,
+        cash_at_risk=args.cash_at_risk,
+        processes=args.processes,
+        chunk_size=args.chunk_size,
+    )
+    elapsed = time.perf_counter() - started
+    print(Fore.CYAN + f"Simulated {args.seeds} seeds over {len(dates)} weeks in {elapsed:.2f}s" + Fore.RESET)
+
+    bands = percentile_bands(result["equity"], dates)
+    returns = result["equity"][:, -1] / args.cash - 1
+    print(Fore.CYAN + "Total return: " + ", ".join(f"p{p} {np.percentile(returns, p):.2%}" for p in PERCENTILES) + Fore.RESET)
+    print(Fore.CYAN + f"Median trade count: {np.median(result['trade_count']):.0f}" + Fore.RESET)
+
+    if args.sentiment_table:
+        llm_dates, llm_close, llm_open, sentiments, shares = load_inputs(start_date, end_date, args.sentiment_table, args.prices_dir)
+        llm = run(llm_close, sentiments, shares, cash=args.cash, fill_prices=llm_open, record_trades=False)["equity"][0]
+        bands["llm"] = pd.Series(llm, index=pd.DatetimeIndex(llm_dates)).reindex(bands.index, method="ffill")
+        llm_return = llm[-1] / args.cash - 1
+        print(
+            Fore.GREEN
+            + f"LLM bot total return {llm_return:.2%}, better than {(returns < llm_return).mean():.1%} of the random runs"
+            + Fore.RESET
+        )
+
+    bands.to_csv(args.out)
+    print(Fore.CYAN + f"Saved the percentile bands to {args.out}" + Fore.RESET)
+    if args.plot:
+        plot_bands(bands, args.plot, f"Random bot {args.bot}, {args.seeds} seeds")
+        print(Fore.CYAN + f"Saved the plot to {args.plot}" + Fore.RESET)
@@ -0,0 +1,121 @@
+from datetime import datetime
+import hashlib
+import math
+import re
+
+# Weight of the news sources when ranking the news items, the others get DEFAULT_SOURCE_WEIGHT
+SOURCE_WEIGHTS = {
+    "reuters": 1.0,
+    "bloomberg": 1.0,
+    "the wall street journal": 1.0,
+    "financial times": 1.0,
+    "cnbc": 0.9,
+    "barron's": 0.9,
+    "marketwatch": 0.8,
+    "yahoo finance": 0.8,
+    "investor's business daily": 0.7,
+    "seeking alpha": 0.6,
+    "motley fool": 0.5,
+    "the motley fool": 0.5,
+}
+DEFAULT_SOURCE_WEIGHT = 0.6
+
+# Number of differing bits below which two simhashes are considered near-duplicates
+SIMHASH_DISTANCE = 6
+
+UNITS_IN_HOURS = {"minute": 1 / 60, "min": 1 / 60, "hour": 1, "day": 24, "week": 24 * 7, "month": 24 * 30, "year": 24 * 365}
+
+
+def item_text(result: dict) -> str:
+    """Returns the text of a news item that goes into the prompt, the same parts format_news uses."""
+    parts = [result["snippet"]] if "snippet" in result else []
+    parts += [f"{attribute}: {value}." for attribute, value in result.get("attributes", {}).items()]
+    return " ".join(parts)
+
+
+def count_tokens(text: str) -> int:
+    """Estimates the number of LLM tokens of the text, about 4 characters per token for English."""
+    return math.ceil(len(text) / 4)
+
+
+def shingles(text: str, size: int = 3) -> set:
+    """Returns the word shingles (overlapping runs of size words) of the text, ignoring case and punctuation."""
+    words = re.findall(r"[a-z0-9]+", text.lower())
+    if len(words) <= size:
+        return {" ".join(words)}
+    return {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+def simhash(text: str) -> int:
+    """Returns the 64 bit simhash of the shingles of the text; near-duplicate texts differ in only a few bits."""
+    weights = [0] * 64
+    for shingle in shingles(text):
+        value = int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest(), "big")
+        for bit in range(64):
+            weights[bit] += 1 if value >> bit & 1 else -1
+    return sum(1 << bit for bit in range(64) if weights[bit] > 0)
+
+
+def age_in_hours(date: str, now: datetime = None) -> float:
+    """
+    Parses the date of a Serper news item, either relative ("3 hours ago") or absolute ("Jan 5, 2024"), into its age
+    in hours. Returns infinity if the date cannot be parsed.
+    """
+    date = (date or "").strip().lower()
+    match = re.match(r"(\d+)\s*(minute|min|hour|day|week|month|year)s?\s+ago", date)
+    if match:
+        return int(match.group(1)) * UNITS_IN_HOURS[match.group(2)]
+
+    for pattern in ("%b %d, %Y", "%d %b %Y", "%Y-%m-%d"):
+        try:
+            published = datetime.strptime(date, pattern)
+        except ValueError:
+            continue
+        return max(((now or datetime.now()) - published).total_seconds() / 3600, 0.0)
+    return math.inf
+
+
+def rank(result: dict, half_life_hours: float = 72, now: datetime = None) -> float:
+    """Ranks a news item by the weight of its source and its recency, which halves every half_life_hours."""
+    source = SOURCE_WEIGHTS.get((result.get("source") or "").strip().lower(), DEFAULT_SOURCE_WEIGHT)
+    age = age_in_hours(result.get("date"), now)
+    recency = 0.5 ** (age / half_life_hours) if math.isfinite(age) else 0.1
+    return source * recency
+
+
+def compact_news(results: dict, token_budget: int, k: int = 15, now: datetime = None):
+    """
+    Compacts a raw Serper news payload before it is put into the prompt: removes the near-duplicate items (syndicated
+    copies of the same story), ranks the remaining items by recency and source, and keeps the best ranked items that
+    fit into token_budget (at least one item).
+    Returns the compacted payload and the stats of the input and output items and tokens.
+    """
+    items = [result for result in results.get("news", [])[:k] if item_text(result)]
+
+    # Keep the first of every group of near-duplicates, comparing the titles and the texts
+    unique = []
+    hashes = []
+    for result in items:
+        fingerprint = simhash(f"{result.get('title', '')} {item_text(result)}")
+        if any(bin(fingerprint ^ other).count("1") <= SIMHASH_DISTANCE for other in hashes):
+            continue
+        hashes.append(fingerprint)
+        unique.append(result)
+
+    kept = []
+    tokens = 0
+    for result in sorted(unique, key=lambda result: rank(result, now=now), reverse=True):
+        item_tokens = count_tokens(item_text(result))
+        if kept and tokens + item_tokens > token_budget:
+            continue
+        kept.append(result)
+        tokens += item_tokens
+
+    stats = {
+        "items_in": len(items),
+        "items_unique": len(unique),
+        "items_out": len(kept),
+        "tokens_in": sum(count_tokens(item_text(result)) for result in items),
+        "tokens_out": tokens,
+    }
+    return {**results, "news": kept}, stats
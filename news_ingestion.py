@@ -0,0 +1,141 @@
+from datetime import datetime, timedelta
+from colorama import Fore
+import threading
+import math
+
+from article_sentiment import aggregate_sentiment, article_hash, article_weight
+from instrumentation import metrics
+from llmprompts import news_query, search_results
+from news_compaction import age_in_hours, item_text
+from sentiment import PROMPT_HASH
+
+
+class NewsIngestor:
+    """
+    Ingests the news of the stocks in the background during the week, for live trading. Every poll_interval seconds it
+    searches the news of every symbol published since its last poll, scores the articles it has not seen before one
+    by one as they arrive, and keeps them for window_days (the news window of Mag7SentimentBot.get_dates).
+
+    At decision time, sentiments returns the rolling per-symbol aggregate from memory, instead of searching and
+    scoring all the news while the orders wait. With an article_cache, the articles that were already scored (e.g. by
+    an earlier run) are read from it instead of being scored again.
+    """
+
+    def __init__(self, symbols: list, engine, poll_interval: float = 900, window_days: int = 7, article_cache=None):
+        self.symbols = list(symbols)
+        self.engine = engine
+        self.article_cache = article_cache
+        self.poll_interval = poll_interval
+        self.window = timedelta(days=window_days)
+        self.lock = threading.Lock()
+        self.articles = {symbol: {} for symbol in self.symbols}
+        self.last_polled = {}
+        self.polls = 0
+        self.scored = 0
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.run, name="news-ingestion", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self, timeout: float = 10):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join(timeout)
+            self.thread = None
+
+    def run(self):
+        while not self.stop_event.is_set():
+            self.poll()
+            self.stop_event.wait(self.poll_interval)
+
+    def poll(self, now: datetime = None):
+        """Polls the news of every symbol once, a symbol that fails is polled again on the next round."""
+        now = now or datetime.now()
+        with metrics.stage("news_ingestion"):
+            for symbol in self.symbols:
+                if self.stop_event.is_set():
+                    return
+                try:
+                    self.poll_symbol(symbol, now)
+                except Exception as e:
+                    print(Fore.RED + f"News ingestion for {symbol} failed: {e}" + Fore.RESET)
+        self.polls += 1
+        self.prune(now)
+
+    def poll_symbol(self, symbol: str, now: datetime):
+        # Search from the day before the last poll, as Serper's date filter only has a granularity of days
+        window_start = now - self.window
+        since = max(window_start, self.last_polled.get(symbol, window_start) - timedelta(days=1))
+        results = search_results(
+            news_query(since.strftime("%Y-%m-%d"), (now + timedelta(days=1)).strftime("%Y-%m-%d"), symbol)
+        )
+
+        with self.lock:
+            seen = set(self.articles[symbol])
+
+        new = {}
+        for result in results.get("news", []):
+            key = article_hash(result)
+            if key in seen or key in new or not item_text(result):
+                continue
+            age = age_in_hours(result.get("date"), now)
+            published = now - timedelta(hours=age) if math.isfinite(age) else now
+            if published >= window_start:
+                new[key] = (result, published)
+
+        # Score the new articles one at a time, an article that fails is scored again on the next poll
+        for key, (result, published) in new.items():
+            score = self.score_article(key, result)
+            with self.lock:
+                self.articles[symbol][key] = {"published": published, "source": result.get("source"), "score": score}
+                self.scored += 1
+        self.last_polled[symbol] = now
+
+    def score_article(self, key: str, result: dict) -> float:
+        if self.article_cache is not None:
+            score = self.article_cache.get(key, self.engine.model, PROMPT_HASH)
+            if score is not None:
+                return score
+
+        article_result = self.engine.score_news(item_text(result))
+        if self.article_cache is not None:
+            self.article_cache.put(key, self.engine.model, PROMPT_HASH, article_result)
+        return article_result["score"]
+
+    def prune(self, now: datetime):
+        """Drops the articles that fell out of the news window."""
+        with self.lock:
+            for articles in self.articles.values():
+                for key in [key for key, article in articles.items() if article["published"] < now - self.window]:
+                    del articles[key]
+
+    def sentiments(self, now: datetime = None) -> dict:
+        """
+        Returns the aggregate sentiment of the articles of every symbol within the news window, a dictionary of symbol
+        to a dictionary with the keys sentiment, score and articles. Symbols without any article are left out.
+        """
+        now = now or datetime.now()
+        sentiments = {}
+        with self.lock:
+            for symbol, articles in self.articles.items():
+                scored = [
+                    (article_weight(article["source"], (now - article["published"]).total_seconds() / 3600), article["score"])
+                    for article in articles.values()
+                    if article["published"] >= now - self.window
+                ]
+                aggregate = aggregate_sentiment(scored)
+                if aggregate is not None:
+                    sentiments[symbol] = aggregate
+        return sentiments
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "polls": self.polls,
+                "articles_scored": self.scored,
+                "articles_in_window": sum(len(articles) for articles in self.articles.values()),
+            }
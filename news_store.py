@@ -0,0 +1,158 @@
+import argparse
+import gzip
+import json
+import sqlite3
+import threading
+import time
+
+
+class NewsStore:
+    """
+    A local store (SQLite) of the raw Serper news payloads, keyed by the exact query string and the news window.
+
+    The store runs in one of three modes:
+    - "live": the store is bypassed and every query goes to the network.
+    - "record": every query goes to the network and the raw payload is written to the store.
+    - "replay": the payloads are served from the store without any network access.
+    """
+
+    MODES = ("live", "record", "replay")
+
+    def __init__(self, path: str = "news_store.sqlite", mode: str = "live"):
+        if mode not in self.MODES:
+            raise ValueError(f"Unknown news store mode {mode!r}, expected one of {self.MODES}")
+
+        self.path = path
+        self.mode = mode
+        self.lock = threading.Lock()
+        self._conn = None
+
+    @property
+    def conn(self):
+        # Connect lazily, so that the live mode never touches the disk
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS news (
+                    query TEXT NOT NULL,
+                    start_date TEXT NOT NULL,
+                    end_date TEXT NOT NULL,
+                    fetched_at REAL NOT NULL,
+                    results TEXT NOT NULL,
+                    PRIMARY KEY (query, start_date, end_date)
+                )
+                """
+            )
+            self._conn.commit()
+        return self._conn
+
+    def fetch(self, query: str, start_date: str, end_date: str, fetcher) -> dict:
+        """
+        Returns the raw news payload for the query according to the mode of the store.
+        fetcher is called with the query to get the payload from the network (e.g. GoogleSerperAPIWrapper.results).
+        """
+        if self.mode == "live":
+            return fetcher(query)
+
+        if self.mode == "replay":
+            results = self.get(query, start_date, end_date)
+            if results is None:
+                raise KeyError(f"No recorded news for {query!r} ({start_date} to {end_date})")
+            return results
+
+        results = fetcher(query)
+        self.put(query, start_date, end_date, results)
+        return results
+
+    def get(self, query: str, start_date: str, end_date: str):
+        """Returns the recorded payload, or None if the query was never recorded."""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT results FROM news WHERE query = ? AND start_date = ? AND end_date = ?",
+                (query, start_date, end_date),
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put(self, query: str, start_date: str, end_date: str, results: dict, fetched_at: float = None):
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO news VALUES (?, ?, ?, ?, ?)",
+                (query, start_date, end_date, fetched_at or time.time(), json.dumps(results, separators=(",", ":"))),
+            )
+            self.conn.commit()
+
+    def size(self) -> int:
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM news").fetchone()[0]
+
+    def export_jsonl(self, path: str) -> int:
+        """
+        Writes every recorded payload to a JSONL file (gzip compressed if the path ends with .gz), one record per line.
+        Returns the number of exported records.
+        """
+        count = 0
+        with self.lock, _open(path, "wt") as f:
+            rows = self.conn.execute(
+                "SELECT query, start_date, end_date, fetched_at, results FROM news ORDER BY start_date, query"
+            )
+            for query, start_date, end_date, fetched_at, results in rows:
+                record = {
+                    "query": query,
+                    "start_date": start_date,
+                    "end_date": end_date,
+                    "fetched_at": fetched_at,
+                    "results": json.loads(results),
+                }
+                f.write(json.dumps(record, separators=(",", ":")) + "\n")
+                count += 1
+        return count
+
+    def import_jsonl(self, path: str) -> int:
+        """
+        Loads the records of a JSONL file written by export_jsonl into the store, replacing records with the same key.
+        Returns the number of imported records.
+        """
+        with _open(path, "rt") as f:
+            rows = [
+                (
+                    record["query"],
+                    record["start_date"],
+                    record["end_date"],
+                    record.get("fetched_at") or time.time(),
+                    json.dumps(record["results"], separators=(",", ":")),
+                )
+                for record in map(json.loads, filter(str.strip, f))
+            ]
+
+        with self.lock:
+            self.conn.executemany("INSERT OR REPLACE INTO news VALUES (?, ?, ?, ?, ?)", rows)
+            self.conn.commit()
+        return len(rows)
+
+    def close(self):
+        with self.lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+def _open(path: str, mode: str):
+    if path.endswith(".gz"):
+        return gzip.open(path, mode, encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bulk import and export of the recorded news store.")
+    parser.add_argument("command", choices=["import", "export"])
+    parser.add_argument("file", help="JSONL file, gzip compressed if it ends with .gz")
+    parser.add_argument("--store", default="news_store.sqlite", help="path of the news store")
+    args = parser.parse_args()
+
+    store = NewsStore(args.store, mode="record")
+    if args.command == "export":
+        print(f"Exported {store.export_jsonl(args.file)} records to {args.file}")
+    else:
+        print(f"Imported {store.import_jsonl(args.file)} records into {args.store}")
+    store.close()
@@ -0,0 +1,300 @@
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+from collections import deque
+from colorama import Fore
+import threading
+import time
+
+from instrumentation import percentile
+
+# Number of recent latencies kept to compute the hedging delay and the per-endpoint percentiles
+LATENCY_WINDOW = 200
+
+
+class Endpoint:
+    """One Ollama server of the pool, with its client, its health and its request counters."""
+
+    def __init__(self, host: str, client):
+        self.host = host
+        self.client = client
+        self.healthy = True
+        self.failures = 0  # Consecutive failed calls
+        self.outstanding = 0
+        self.calls = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.hedges = 0
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+
+    def stats(self) -> dict:
+        latencies = list(self.latencies)
+        return {
+            "host": self.host or "default",
+            "healthy": self.healthy,
+            "calls": self.calls,
+            "errors": self.errors,
+            "timeouts": self.timeouts,
+            "hedges": self.hedges,
+            "outstanding": self.outstanding,
+            "p50": percentile(latencies, 50),
+            "p95": percentile(latencies, 95),
+            "max": max(latencies, default=0.0),
+        }
+
+
+class Attempt:
+    """One call of a request on one endpoint. Once abandoned, its late outcome is no longer recorded."""
+
+    def __init__(self, endpoint: Endpoint):
+        self.endpoint = endpoint
+        self.future = Future()
+        self.abandoned = False
+
+
+class OllamaPool:
+    """
+    Spreads the calls of an Ollama client over several Ollama servers (hosts, None for the default one), with the same
+    chat and generate methods as ollama.Client.
+
+    Every call goes to the healthy endpoint with the fewest outstanding requests, and has timeout seconds before it
+    fails with a TimeoutError; the clients' HTTP requests are bounded by the same timeout. A call that is still running
+    after the hedge_percentile latency of the recent calls is sent again to a second endpoint, and the first response
+    wins; a call that fails is sent to a second endpoint at once. An endpoint that fails failure_threshold calls in a
+    row is taken out of rotation until a health check, run every health_interval seconds, finds it answering again.
+    """
+
+    def __init__(
+        self,
+        hosts: list,
+        timeout: float = None,
+        hedge_percentile: float = 95,
+        min_samples: int = 20,
+        failure_threshold: int = 3,
+        health_interval: float = 30,
+    ):
+        from ollama import Client
+
+        self.endpoints = [Endpoint(host, Client(host=host, timeout=timeout)) for host in hosts or [None]]
+        self.timeout = timeout
+        self.hedge_percentile = hedge_percentile
+        self.min_samples = min_samples
+        self.failure_threshold = failure_threshold
+        self.lock = threading.Lock()
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.failovers = 0
+
+        self.stop_event = threading.Event()
+        if len(self.endpoints) > 1 and health_interval:
+            threading.Thread(
+                target=self.run_health_checks, args=(health_interval,), name="ollama-health", daemon=True
+            ).start()
+
+    def route(self, exclude=()) -> Endpoint:
+        """
+        Returns the healthy endpoint with the fewest outstanding requests, None if there is none outside of exclude.
+        When every endpoint is out of rotation, the calls still go to the least busy one rather than failing outright.
+        """
+        with self.lock:
+            candidates = [endpoint for endpoint in self.endpoints if endpoint not in exclude]
+            healthy = [endpoint for endpoint in candidates if endpoint.healthy]
+            if healthy or exclude:
+                candidates = healthy
+            return min(candidates, key=lambda endpoint: (endpoint.outstanding, endpoint.calls), default=None)
+
+    def hedge_delay(self):
+        """Returns the time after which a call is hedged, None until enough calls were seen or if hedging is off."""
+        if self.hedge_percentile is None or len(self.endpoints) < 2:
+            return None
+        with self.lock:
+            latencies = list(self.latencies)
+        return percentile(latencies, self.hedge_percentile) if len(latencies) >= self.min_samples else None
+
+    def submit(self, endpoint: Endpoint, method: str, kwargs: dict, sample: bool = True) -> Attempt:
+        """Starts the call on the endpoint. With sample False, its latency is kept out of the hedging window."""
+        attempt = Attempt(endpoint)
+        with self.lock:
+            endpoint.outstanding += 1
+            endpoint.calls += 1
+
+        def call():
+            start = time.perf_counter()
+            try:
+                result = getattr(endpoint.client, method)(**kwargs)
+            except Exception as e:
+                self.record_failure(attempt)
+                attempt.future.set_exception(e)
+            else:
+                self.record_success(attempt, time.perf_counter() - start if sample else None)
+                attempt.future.set_result(result)
+
+        # A daemon thread per call, so a call that was abandoned never holds up the exit; the client's timeout ends it
+        threading.Thread(target=call, name="ollama-call", daemon=True).start()
+        return attempt
+
+    def record_success(self, attempt: Attempt, latency: float = None):
+        endpoint = attempt.endpoint
+        with self.lock:
+            endpoint.outstanding -= 1
+            if attempt.abandoned:
+                return  # Already counted when it was abandoned, a late answer says nothing about the endpoint
+            if latency is not None:
+                endpoint.latencies.append(latency)
+                self.latencies.append(latency)
+            endpoint.failures = 0
+            endpoint.healthy = True
+
+    def record_failure(self, attempt: Attempt):
+        with self.lock:
+            attempt.endpoint.outstanding -= 1
+            if attempt.abandoned:
+                return
+            attempt.endpoint.errors += 1
+            self.count_failure(attempt.endpoint)
+
+    def abandon(self, attempt: Attempt, timed_out: bool = False):
+        """Stops waiting for the attempt, counting a failure of its endpoint if it missed its deadline."""
+        with self.lock:
+            attempt.abandoned = True
+            if timed_out:
+                attempt.endpoint.timeouts += 1
+                self.count_failure(attempt.endpoint)
+
+    def count_failure(self, endpoint: Endpoint):
+        # Called with the lock held
+        endpoint.failures += 1
+        if endpoint.healthy and endpoint.failures >= self.failure_threshold and len(self.endpoints) > 1:
+            endpoint.healthy = False
+            print(
+                Fore.YELLOW
+                + f"Taking Ollama endpoint {endpoint.host} out of rotation after {endpoint.failures} failures"
+                + Fore.RESET
+            )
+
+    def request(self, method: str, **kwargs):
+        """
+        Calls the method of the Ollama client on the pool, hedging and failing over as described above. The first
+        attempt keeps running until the deadline, a hedge races it rather than replacing it, so a slow endpoint that
+        answers within the deadline is never cut short.
+        """
+        start = time.monotonic()
+        deadline = start + self.timeout if self.timeout else None
+        hedge_at = self.hedge_delay()
+        primary = self.route()
+
+        attempt = self.submit(primary, method, kwargs)
+        attempts = {attempt.future: attempt}
+        backup = None
+        duplicated = False
+        hedging = False
+        error = None
+
+        while attempts:
+            times = [deadline] if deadline is not None else []
+            if not duplicated and hedge_at is not None:
+                times.append(start + hedge_at)
+            timeout = max(0.0, min(times) - time.monotonic()) if times else None
+            done, _ = wait(attempts, timeout=timeout, return_when=FIRST_COMPLETED)
+
+            for future in done:
+                attempt = attempts.pop(future)
+                if future.exception() is None:
+                    if hedging and attempt.endpoint is backup:
+                        with self.lock:
+                            self.hedge_wins += 1
+                    # The losing attempts are still running, their outcome is not recorded
+                    for other in attempts.values():
+                        self.abandon(other)
+                    return future.result()
+                error = future.exception()
+
+            now = time.monotonic()
+            if deadline is not None and now >= deadline:
+                break
+
+            # Send a duplicate to a second endpoint when the call failed, or is slower than the hedging latency
+            slow = hedge_at is not None and now >= start + hedge_at
+            if not duplicated and (not attempts or slow):
+                duplicated = True
+                backup = self.route(exclude=[primary])
+                if backup is None:
+                    continue  # No second endpoint to send it to
+                hedging = bool(attempts)
+                with self.lock:
+                    if hedging:
+                        self.hedged += 1
+                        backup.hedges += 1
+                    else:
+                        self.failovers += 1
+                attempt = self.submit(backup, method, kwargs)
+                attempts[attempt.future] = attempt
+
+        # Only the attempts still running at the deadline missed it, one that lost to a faster one is not a failure
+        for attempt in attempts.values():
+            self.abandon(attempt, timed_out=True)
+        if attempts:
+            raise TimeoutError(f"Ollama {method} call missed its deadline of {self.timeout}s")
+        raise error
+
+    def chat(self, **kwargs):
+        return self.request("chat", **kwargs)
+
+    def generate(self, **kwargs):
+        return self.request("generate", **kwargs)
+
+    def broadcast(self, method: str, **kwargs) -> list:
+        """
+        Calls the method on every endpoint at once, e.g. to load the model on all of them, bounded only by the clients'
+        timeout and kept out of the latencies.
+        Returns the responses of the endpoints that answered, and raises the error if none did.
+        """
+        attempts = [self.submit(endpoint, method, kwargs, sample=False) for endpoint in self.endpoints]
+        wait([attempt.future for attempt in attempts])
+        responses = []
+        for attempt in attempts:
+            if attempt.future.exception() is None:
+                responses.append(attempt.future.result())
+            else:
+                error = attempt.future.exception()
+                print(Fore.YELLOW + f"Ollama {method} on {attempt.endpoint.host} failed: {error}" + Fore.RESET)
+        if not responses:
+            raise attempts[0].future.exception()
+        return responses
+
+    def check_health(self):
+        """Probes every endpoint with a cheap request, taking the failing ones out of rotation and back in."""
+        for endpoint in self.endpoints:
+            try:
+                endpoint.client.ps()
+                answered = True
+            except Exception:
+                answered = False
+
+            with self.lock:
+                if answered and not endpoint.healthy:
+                    print(Fore.GREEN + f"Ollama endpoint {endpoint.host} is back in rotation" + Fore.RESET)
+                elif not answered and endpoint.healthy:
+                    print(
+                        Fore.YELLOW
+                        + f"Taking Ollama endpoint {endpoint.host} out of rotation, health check failed"
+                        + Fore.RESET
+                    )
+                endpoint.healthy = answered
+                endpoint.failures = 0 if answered else max(endpoint.failures, self.failure_threshold)
+
+    def run_health_checks(self, interval: float):
+        while not self.stop_event.wait(interval):
+            self.check_health()
+
+    def close(self):
+        self.stop_event.set()
+
+    def stats(self) -> dict:
+        """Returns the hedging counters of the pool and the latency and error stats of every endpoint."""
+        with self.lock:
+            return {
+                "hedged": self.hedged,
+                "hedge_wins": self.hedge_wins,
+                "failovers": self.failovers,
+                "endpoints": [endpoint.stats() for endpoint in self.endpoints],
+            }
@@ -0,0 +1,182 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta
+from colorama import Fore
+import argparse
+import threading
+import os
+
+import pandas_market_calendars as mcal
+import pandas as pd
+
+from sentiment import MODEL, get_sentiments, ollama_capacity
+from sentiment_cache import ArticleSentimentCache, SentimentCache
+from sentiment_cascade import SentimentCascade
+from universe import MAG7, load_universe
+
+COLUMNS = ["week", "symbol", "start_date", "end_date", "sentiment", "score", "model"]
+
+
+def weekly_windows(start_date: datetime, end_date: datetime, calendar_name: str = "NYSE") -> list:
+    """
+    Returns the (day_prior, today) news windows that Mag7SentimentBot.get_dates produces when the bot wakes up on the
+    first trading session of every (ISO year, ISO week) after start_date until end_date, the same days as the weekly
+    bars of fast_backtest.
+    """
+    sessions = mcal.get_calendar(calendar_name).valid_days(start_date=start_date + timedelta(days=1), end_date=end_date)
+    windows = []
+    weeks = set()
+    for session in sessions:
+        today = session.date()
+        if today.isocalendar()[:2] in weeks:
+            continue
+        weeks.add(today.isocalendar()[:2])
+        day_prior = today - timedelta(days=7)
+        windows.append((day_prior.strftime("%Y-%m-%d"), today.strftime("%Y-%m-%d")))
+    return windows
+
+
+def load_table(path: str) -> pd.DataFrame:
+    """Loads a sentiment table, or returns an empty one if it does not exist yet."""
+    if os.path.exists(path):
+        return pd.read_parquet(path)
+    return pd.DataFrame(columns=COLUMNS)
+
+
+class SentimentTable:
+    """
+    A precomputed sentiment table loaded in memory, for the bot to read the weekly sentiments instead of calling the LLM.
+    """
+
+    def __init__(self, path: str = "sentiments.parquet"):
+        table = load_table(path)
+        self.scores = {}
+        for week, symbol, score in zip(table["week"], table["symbol"], table["score"]):
+            self.scores.setdefault(week, {})[symbol] = float(score)
+
+    def get(self, today: str) -> dict:
+        """
+        Returns the scores of the week the bot wakes up on today, or an empty dictionary if the table has no week
+        starting today. An older week is never used, as its news window does not match the one the bot would score.
+        """
+        return dict(self.scores.get(today, {}))
+
+
+def save_table(table: pd.DataFrame, path: str):
+    # Write to a temporary file first so that a crash never leaves a half written table behind
+    table = table.sort_values(["week", "symbol"]).reset_index(drop=True)
+    table.to_parquet(path + ".tmp", index=False)
+    os.replace(path + ".tmp", path)
+
+
+def precompute(
+    start_date: datetime,
+    end_date: datetime,
+    symbols: list,
+    out: str = "sentiments.parquet",
+    workers: int = 2,
+    model: str = MODEL,
+    batch_size: int = None,
+    token_budget: int = None,
+    cascade: SentimentCascade = None,
+    cache_path: str = "sentiment_cache.sqlite",
+    article_cache_path: str = None,
+) -> pd.DataFrame:
+    """
+    Computes the sentiment of every symbol for every weekly window and writes them to a Parquet table indexed by
+    (week, symbol), where week is the date the bot wakes up. The table is saved after every week, and the weeks and
+    symbols that are already in the table are skipped, so an interrupted run resumes where it stopped.
+    """
+    table = load_table(out)
+    done = set(zip(table["week"], table["symbol"]))
+    todo = [
+        (day_prior, today, [symbol for symbol in symbols if (today, symbol) not in done])
+        for day_prior, today in weekly_windows(start_date, end_date)
+    ]
+    todo = [(day_prior, today, missing) for day_prior, today, missing in todo if missing]
+    print(Fore.CYAN + f"{len(todo)} weeks to compute, {len(done)} sentiments already in {out}" + Fore.RESET)
+
+    cache = SentimentCache(cache_path) if cache_path else None
+    article_cache = ArticleSentimentCache(article_cache_path) if article_cache_path else None
+    lock = threading.Lock()
+
+    # The weeks run concurrently, so share the Ollama servers' parallel slots between them
+    llm_workers = max(1, ollama_capacity() // workers)
+
+    def compute_week(day_prior, today, missing):
+        results = get_sentiments(
+            missing,
+            news_start_date=day_prior,
+            news_end_date=today,
+            model=model,
+            cache=cache,
+            llm_workers=llm_workers,
+            batch_size=batch_size,
+            token_budget=token_budget,
+            cascade=cascade,
+            article_cache=article_cache,
+        )
+        return [
+            {
+                "week": today,
+                "symbol": symbol,
+                "start_date": day_prior,
+                "end_date": today,
+                "sentiment": result["sentiment"],
+                "score": result["score"],
+                "model": result.get("model", model),
+            }
+            for symbol, result in results.items()
+        ]
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(compute_week, *week) for week in todo]
+        for future in as_completed(futures):
+            rows = future.result()
+            if not rows:
+                continue
+
+            # Checkpoint the table after every week
+            with lock:
+                table = pd.concat([table, pd.DataFrame(rows, columns=COLUMNS)], ignore_index=True)
+                save_table(table, out)
+            print(Fore.GREEN + f"Saved the sentiments of the week of {rows[0]['week']}" + Fore.RESET)
+
+    if cache is not None:
+        print(Fore.CYAN + f"Sentiment cache: {cache.stats()}" + Fore.RESET)
+        cache.close()
+    if article_cache is not None:
+        print(Fore.CYAN + f"Article sentiment cache: {article_cache.stats()}" + Fore.RESET)
+        article_cache.close()
+    if cascade is not None:
+        print(Fore.CYAN + f"Sentiment cascade: {cascade.stats()}" + Fore.RESET)
+    return table
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Precompute the weekly sentiment table for the backtests.")
+    parser.add_argument("--start", required=True, help="backtesting start date, YYYY-MM-DD")
+    parser.add_argument("--end", required=True, help="backtesting end date, YYYY-MM-DD")
+    parser.add_argument("--symbols", default=",".join(MAG7), help="comma separated list of stock symbols, or an index file")
+    parser.add_argument("--out", default="sentiments.parquet", help="path of the Parquet sentiment table")
+    parser.add_argument("--workers", type=int, default=2, help="number of weeks computed concurrently")
+    parser.add_argument("--model", default=MODEL)
+    parser.add_argument("--batch-size", type=int, default=None, help="number of symbols scored per LLM call")
+    parser.add_argument("--token-budget", type=int, default=None, help="news tokens per symbol put into the prompt")
+    parser.add_argument("--cascade", action="store_true", help="score with the lexicon first, the LLM when uncertain")
+    parser.add_argument("--cache", default="sentiment_cache.sqlite", help="path of the sentiment cache")
+    parser.add_argument("--article-cache", default=None, help="path of the article sentiment store, to score per article")
+    args = parser.parse_args()
+
+    precompute(
+        datetime.strptime(args.start, "%Y-%m-%d"),
+        datetime.strptime(args.end, "%Y-%m-%d"),
+        load_universe(args.symbols),
+        out=args.out,
+        workers=args.workers,
+        model=args.model,
+        batch_size=args.batch_size,
+        token_budget=args.token_budget,
+        cascade=SentimentCascade() if args.cascade else None,
+        cache_path=args.cache,
+        article_cache_path=args.article_cache,
+    )
@@ -0,0 +1,49 @@
+import threading
+
+from dotenv import load_dotenv
+
+_factories = {}
+_instances = {}
+_lock = threading.RLock()
+_env_loaded = False
+
+
+def load_env():
+    """Loads the .env file once, the first time a provider needs its settings."""
+    global _env_loaded
+    with _lock:
+        if not _env_loaded:
+            load_dotenv()
+            _env_loaded = True
+
+
+def register(name: str, factory):
+    """
+    Registers the factory of a provider (e.g. the news search or the LLM client). The factory is only called, and its
+    heavy imports only paid for, the first time the provider is used.
+    """
+    with _lock:
+        _factories[name] = factory
+        _instances.pop(name, None)
+
+
+def get(name: str):
+    """Returns the provider, creating it on first use."""
+    if name in _instances:
+        return _instances[name]
+    with _lock:
+        if name not in _instances:
+            if name not in _factories:
+                raise KeyError(f"No provider registered as {name}")
+            load_env()
+            _instances[name] = _factories[name]()
+        return _instances[name]
+
+
+def reset(name: str = None):
+    """Drops the created provider (or all of them), so it is created again on next use, e.g. after a settings change."""
+    with _lock:
+        if name is None:
+            _instances.clear()
+        else:
+            _instances.pop(name, None)
@@ -0,0 +1,40 @@
+import multiprocessing
+import time
+
+
+class TokenBucket:
+    """
+    A token bucket rate limiter that is shared by processes: rate tokens are added per second, up to capacity, and
+    every call takes one. The state lives in shared memory, so a bucket passed to the worker processes when they
+    start (e.g. as an initializer argument of a ProcessPoolExecutor) limits all of them together.
+    """
+
+    def __init__(self, rate: float, capacity: float = None, context=None):
+        context = context or multiprocessing.get_context()
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self.lock = context.Lock()
+        self.tokens = context.Value("d", self.capacity, lock=False)
+        self.updated = context.Value("d", time.time(), lock=False)
+        self.calls = context.Value("i", 0, lock=False)
+        self.waited = context.Value("d", 0.0, lock=False)
+
+    def acquire(self, tokens: float = 1.0) -> float:
+        """Waits until tokens are available and takes them, returns the time waited in seconds."""
+        start = time.time()
+        while True:
+            with self.lock:
+                now = time.time()
+                self.tokens.value = min(self.capacity, self.tokens.value + (now - self.updated.value) * self.rate)
+                self.updated.value = now
+                if self.tokens.value >= tokens:
+                    self.tokens.value -= tokens
+                    self.calls.value += 1
+                    self.waited.value += now - start
+                    return now - start
+                wait = (tokens - self.tokens.value) / self.rate
+            time.sleep(wait)
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {"calls": self.calls.value, "waited": self.waited.value}
@@ -0,0 +1,468 @@
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from datetime import datetime
+from colorama import Fore
+import threading
+import math
+import time
+import json
+import os
+
+from pydantic import BaseModel, Field, ValidationError, create_model
+
+from article_sentiment import aggregate_sentiment, article_hash, article_weight
+from instrumentation import metrics, percentile
+from llmprompts import batch_sentiment_messages, format_news, get_news_results, get_web_deets, sentiment_messages
+from news_compaction import age_in_hours, compact_news, item_text
+from ollama_pool import OllamaPool
+from sentiment_cache import prompt_hash
+import providers
+
+MODEL = "qwen2.5:14b"
+PROMPT_HASH = prompt_hash(lambda news: json.dumps(sentiment_messages(news)))
+BATCH_PROMPT_HASH = prompt_hash(lambda _: json.dumps(batch_sentiment_messages({})))
+
+# A call that spent longer than this loading the model (in seconds) is counted as a cold start
+COLD_START_SECONDS = 1.0
+
+# Deadline of every LLM call in seconds, so a stuck generation cannot stall the weekly iteration
+LLM_CALL_TIMEOUT = 120
+
+# Number of news searches a sentiment pass runs at once, so a large universe does not open a thread and a Serper
+# request for every symbol
+NEWS_FETCH_WORKERS = 8
+
+
+class Response(BaseModel):
+    sentiment: str
+    score: float
+
+    class Config:
+        schema_extra = {
+            "example": {
+                "sentiment": "positive",
+                "score": 0.2
+            }
+        }
+
+
+def batch_response_model(symbols: list):
+    """
+    Builds the structured output schema of a batched request, a map of every stock symbol to a Response.
+    The fields are aliased, as stock symbols such as BRK.B are not valid field names.
+    """
+    fields = {f"symbol_{i}": (Response, Field(alias=symbol)) for i, symbol in enumerate(symbols)}
+    return create_model("BatchResponse", **fields)
+
+
+def ollama_num_parallel() -> int:
+    """
+    Returns the number of requests the Ollama server handles in parallel, which is read from OLLAMA_NUM_PARALLEL
+    (the same environment variable the server uses), defaulting to the server's default of 4.
+    """
+    return max(1, int(os.getenv("OLLAMA_NUM_PARALLEL", "4")))
+
+
+def ollama_hosts() -> list:
+    """
+    Returns the Ollama servers to spread the LLM calls over, read from OLLAMA_HOSTS (a comma separated list of hosts),
+    defaulting to the single server of OLLAMA_HOST.
+    """
+    providers.load_env()
+    hosts = [host.strip() for host in os.getenv("OLLAMA_HOSTS", "").split(",") if host.strip()]
+    return hosts or [os.getenv("OLLAMA_HOST")]
+
+
+def ollama_capacity() -> int:
+    """Returns the number of requests all the Ollama servers handle in parallel."""
+    return ollama_num_parallel() * len(ollama_hosts())
+
+
+def active_prompt_hash(batch_size: int = None, token_budget: int = None, article_level: bool = False) -> str:
+    """
+    Returns the hash of the prompt template used to score the sentiments with the given batch size. The news token
+    budget and the article level scoring change what goes into the prompt, so they are part of the hash as well.
+    """
+    if article_level:
+        template_hash = f"{PROMPT_HASH}-a"
+    else:
+        template_hash = BATCH_PROMPT_HASH if batch_size and batch_size > 1 else PROMPT_HASH
+    return f"{template_hash}-t{token_budget}" if token_budget is not None else template_hash
+
+
+def active_prompt_hashes(batch_size: int = None, token_budget: int = None, article_level: bool = False) -> list:
+    """
+    Returns the hashes the sentiments scored with the given batch size are cached under: the one of active_prompt_hash,
+    and the one of the single stock prompt, which scores the symbols of a batch that are scored alone.
+    """
+    template_hash = active_prompt_hash(batch_size, token_budget, article_level)
+    single_hash = template_hash if article_level else active_prompt_hash(None, token_budget)
+    return list(dict.fromkeys([template_hash, single_hash]))
+
+
+def llm_stats(stream) -> dict:
+    """Collects the token counts and durations (in seconds) that Ollama reports with every response."""
+    return {
+        "prompt_tokens": stream.get("prompt_eval_count") or 0,
+        "eval_tokens": stream.get("eval_count") or 0,
+        "eval_duration": (stream.get("eval_duration") or 0) / 1e9,
+        "total_duration": (stream.get("total_duration") or 0) / 1e9,
+        "load_duration": (stream.get("load_duration") or 0) / 1e9,
+    }
+
+
+def record_llm_stats(stream, stats: list = None):
+    """Records the token metrics of a response in the instrumentation, and in the stats of the pass if given."""
+    stream_stats = llm_stats(stream)
+    metrics.record_llm(stream_stats)
+    if stats is not None:
+        stats.append(stream_stats)
+
+
+class SentimentEngine:
+    """
+    Scores the sentiment of the news with one Ollama client per server, whose HTTP connections are pooled and reused by
+    all the calls (and threads) of a run. The calls are spread over the hosts (defaults to ollama_hosts) by an
+    OllamaPool, which gives every call timeout seconds and hedges the slow ones on a second server.
+    The model is loaded once by warm and kept loaded for keep_alive (-1 pins it until release is called), so the weekly
+    calls do not pay the model load time. The wall time of every call is kept, and the calls that had to load the
+    model are counted as cold starts.
+    """
+
+    def __init__(
+        self,
+        model: str = MODEL,
+        host: str = None,
+        keep_alive=-1,
+        timeout: float = LLM_CALL_TIMEOUT,
+        hosts: list = None,
+    ):
+        self.model = model
+        self.keep_alive = keep_alive
+
+        # The pool imports the ollama client only now, as the backtests that read precomputed sentiments never need it
+        self.pool = OllamaPool(hosts or ([host] if host else ollama_hosts()), timeout=timeout)
+        self.lock = threading.Lock()
+        self.latencies = []
+        self.cold_starts = 0
+
+    def warm(self) -> float:
+        """Loads the model into memory on every server with an empty request, returns the time it took in seconds."""
+        start = time.perf_counter()
+        with metrics.stage("ollama_warmup"):
+            self.pool.broadcast("generate", model=self.model, prompt="", keep_alive=self.keep_alive)
+        return time.perf_counter() - start
+
+    def release(self, keep_alive="5m"):
+        """Hands the model back to the servers' usual expiry (keep_alive), instead of keeping it pinned."""
+        self.pool.broadcast("generate", model=self.model, prompt="", keep_alive=keep_alive)
+        self.pool.close()
+
+    def chat(self, messages: list, response_format: dict, stats: list = None):
+        start = time.perf_counter()
+        with metrics.stage("ollama_chat"):
+            stream = self.pool.chat(
+                model=self.model,
+                messages=messages,
+                format=response_format,
+                keep_alive=self.keep_alive,
+            )
+        latency = time.perf_counter() - start
+
+        with self.lock:
+            self.latencies.append(latency)
+            if (stream.get("load_duration") or 0) / 1e9 > COLD_START_SECONDS:
+                self.cold_starts += 1
+        record_llm_stats(stream, stats)
+        return stream
+
+    def score_news(self, news: str, stats: list = None) -> dict:
+        """
+        Uses the LLM to score the sentiment of the news, returns a dictionary with the keys sentiment and score.
+        """
+        stream = self.chat(sentiment_messages(news), Response.model_json_schema(), stats)
+        return Response.model_validate_json(stream["message"]["content"]).model_dump()
+
+    def score_news_batch(self, news_by_symbol: dict, stats: list = None) -> dict:
+        """
+        Uses one LLM call to score the sentiment of the news of several stocks, returns a dictionary of symbol to the
+        parsed response. Symbols that are missing from the response or fail to parse are left out.
+        """
+        symbols = list(news_by_symbol)
+        stream = self.chat(
+            batch_sentiment_messages(news_by_symbol), batch_response_model(symbols).model_json_schema(), stats
+        )
+
+        try:
+            content = json.loads(stream["message"]["content"])
+        except json.JSONDecodeError:
+            return {}
+        if not isinstance(content, dict):
+            return {}
+
+        results = {}
+        for symbol in symbols:
+            try:
+                results[symbol] = Response.model_validate(content.get(symbol)).model_dump()
+            except ValidationError:
+                continue
+        return results
+
+    def latency_summary(self) -> dict:
+        """Returns the number of calls, the p50, p95 and max latency (in seconds) and the number of cold starts."""
+        with self.lock:
+            latencies = list(self.latencies)
+        return {
+            "calls": len(latencies),
+            "p50": percentile(latencies, 50),
+            "p95": percentile(latencies, 95),
+            "max": max(latencies, default=0.0),
+            "cold_starts": self.cold_starts,
+        }
+
+    def endpoint_stats(self) -> dict:
+        """Returns the hedging counters and the latency and error stats of every Ollama server, see OllamaPool.stats."""
+        return self.pool.stats()
+
+
+# One engine per model, shared by the passes that are not given an engine
+engines = {}
+engines_lock = threading.Lock()
+
+
+def get_engine(model: str = MODEL) -> SentimentEngine:
+    """Returns the shared engine of the model, creating it on first use."""
+    with engines_lock:
+        if model not in engines:
+            engines[model] = SentimentEngine(model)
+        return engines[model]
+
+
+@metrics.timed("get_sentiments")
+def get_sentiments(
+    symbols: list,
+    news_start_date: str,
+    news_end_date: str,
+    model: str = MODEL,
+    cache=None,
+    llm_workers: int = None,
+    timeout: float = 300,
+    batch_size: int = None,
+    token_budget: int = None,
+    engine: SentimentEngine = None,
+    cascade=None,
+    article_cache=None,
+) -> dict:
+    """
+    Gets the sentiments of the stocks within the news window, returns a dictionary of symbol to the parsed response.
+
+    The news of up to NEWS_FETCH_WORKERS symbols is fetched concurrently and fed into at most llm_workers (defaults to
+    OLLAMA_NUM_PARALLEL for every Ollama server of the engine) concurrent LLM calls. Every symbol has timeout seconds from the start of the
+    pass to be scored; a symbol that fails or times out is left out of the result without losing the other symbols.
+
+    If batch_size is more than 1, the news of up to batch_size symbols is scored in a single LLM call, and the symbols
+    that are missing from the batched response are scored again one by one.
+
+    If token_budget is set, the news of every symbol is deduplicated and cut down to about token_budget tokens before
+    it is put into the prompt.
+
+    The LLM calls go through engine, which defaults to the shared engine of the model.
+
+    If a cascade (see sentiment_cascade.SentimentCascade) is given, the news of every symbol is scored by its lexicon
+    first, and only the symbols it is uncertain about are scored by the LLM.
+
+    If an article_cache (see sentiment_cache.ArticleSentimentCache) is given, every news article is scored on its own
+    and stored in it by its content hash, and the sentiment of a symbol is the source and recency weighted mean of its
+    article sentiments, so only the articles that were never seen before are sent to the LLM. With a cascade too, the
+    lexicon scores the news of the symbol first, and only the symbols it is uncertain about have their articles scored.
+    """
+    engine = engine or get_engine(model)
+    model = engine.model
+    sentiments = {}
+    pending = []
+    hashes = active_prompt_hashes(batch_size, token_budget, article_level=article_cache is not None)
+    template_hash, single_hash = hashes[0], hashes[-1]
+
+    # Reuse the sentiments from an earlier run of the same window if they are cached, batched or not
+    for symbol in symbols:
+        result = cache.get(symbol, news_start_date, news_end_date, model, *hashes) if cache is not None else None
+        if result is not None:
+            print(Fore.LIGHTBLUE_EX + f"Sentiment for {symbol} (cached): {result}" + Fore.RESET)
+            sentiments[symbol] = result
+        else:
+            pending.append(symbol)
+
+    if not pending:
+        return sentiments
+
+    llm_workers = llm_workers or ollama_num_parallel() * len(engine.pool.endpoints)
+    llm_slots = threading.BoundedSemaphore(llm_workers)
+    news_slots = threading.BoundedSemaphore(NEWS_FETCH_WORKERS)
+    stats = []
+
+    def fetch_news(symbol):
+        with news_slots:
+            return get_web_deets(
+                news_start_date=news_start_date,
+                news_end_date=news_end_date,
+                stock_name=symbol,
+                token_budget=token_budget,
+            )
+
+    def score_symbol(symbol, news):
+        # Use the LLM to get the sentiment, waiting for a free slot on the Ollama server
+        with llm_slots:
+            result = engine.score_news(news, stats)
+
+        # Scored with the single stock prompt, whatever the batch size
+        if cache is not None:
+            cache.put(symbol, news_start_date, news_end_date, model, single_hash, result)
+        return result
+
+    def score_articles(symbol):
+        with news_slots:
+            results = get_news_results(news_start_date, news_end_date, symbol)
+        # Rank and weigh the articles by their age at the end of the news window
+        window_end = datetime.strptime(news_end_date, "%Y-%m-%d")
+        if token_budget is not None:
+            results, news_stats = compact_news(results, token_budget, now=window_end)
+            metrics.record_news(news_stats, symbol)
+
+        # Keep the lexicon sentiment if the cascade is sure about it, as for the news scored as a whole
+        lexicon = reason = None
+        if cascade is not None:
+            with metrics.stage("lexicon_score"):
+                lexicon, reason = cascade.score(format_news(results), f"{symbol} {news_start_date} {news_end_date}")
+            if reason is None:
+                return {symbol: {"sentiment": lexicon["sentiment"], "score": lexicon["score"], "model": "lexicon"}}
+
+        scored = {}
+        for result in results.get("news", [])[:15]:
+            text = item_text(result)
+            key = article_hash(result)
+            if not text or key in scored:
+                continue
+
+            score = article_cache.get(key, model, PROMPT_HASH)
+            if score is None:
+                with llm_slots:
+                    article_result = engine.score_news(text, stats)
+                article_cache.put(key, model, PROMPT_HASH, article_result)
+                score = article_result["score"]
+
+            age = age_in_hours(result.get("date"), window_end)
+            scored[key] = (article_weight(result.get("source"), age if math.isfinite(age) else 0), score)
+
+        result = aggregate_sentiment(list(scored.values()))
+        if result is None:
+            return {}
+        result = {"sentiment": result["sentiment"], "score": result["score"]}
+        if cache is not None:
+            cache.put(symbol, news_start_date, news_end_date, model, template_hash, result)
+        if lexicon is not None:
+            cascade.compare(lexicon, result, reason)
+        return {symbol: result}
+
+    def score_batch(batch):
+        if article_cache is not None:
+            results = {}
+            for symbol in batch:
+                results.update(score_articles(symbol))
+            return results
+
+        # Collect the news of every stock of the batch concurrently, a stock without news is left out of the batch
+        news_by_symbol = {}
+        with ThreadPoolExecutor(max_workers=min(len(batch), NEWS_FETCH_WORKERS)) as news_pool:
+            for symbol, future in [(symbol, news_pool.submit(fetch_news, symbol)) for symbol in batch]:
+                try:
+                    news_by_symbol[symbol] = future.result()
+                except Exception as e:
+                    print(Fore.RED + f"News for {symbol} failed: {e}" + Fore.RESET)
+
+        # Keep the lexicon sentiments the cascade is sure about, and send only the others to the LLM
+        escalations = {}
+        lexicon_results = {}
+        if cascade is not None:
+            with metrics.stage("lexicon_score"):
+                for symbol, news in news_by_symbol.items():
+                    lexicon, reason = cascade.score(news, f"{symbol} {news_start_date} {news_end_date}")
+                    if reason is None:
+                        lexicon_results[symbol] = {"sentiment": lexicon["sentiment"], "score": lexicon["score"], "model": "lexicon"}
+                    else:
+                        escalations[symbol] = (lexicon, reason)
+            news_by_symbol = {symbol: news_by_symbol[symbol] for symbol in escalations}
+
+        results = score_llm(news_by_symbol)
+        for symbol, (lexicon, reason) in escalations.items():
+            if symbol in results:
+                cascade.compare(lexicon, results[symbol], reason)
+        return {**lexicon_results, **results}
+
+    def score_llm(news_by_symbol):
+        if not news_by_symbol:
+            return {}
+        if len(news_by_symbol) == 1:
+            return {symbol: score_symbol(symbol, news) for symbol, news in news_by_symbol.items()}
+
+        try:
+            with llm_slots:
+                results = engine.score_news_batch(news_by_symbol, stats)
+        except Exception as e:
+            print(Fore.YELLOW + f"Batched sentiment of {', '.join(news_by_symbol)} failed: {e}" + Fore.RESET)
+            results = {}
+
+        if cache is not None:
+            for symbol, result in results.items():
+                cache.put(symbol, news_start_date, news_end_date, model, template_hash, result)
+
+        # Fall back to scoring the stocks that are missing from the batched response, or the whole batch if the call
+        # failed, one by one
+        for symbol in news_by_symbol.keys() - results.keys():
+            print(Fore.YELLOW + f"No batched sentiment for {symbol}, scoring it alone" + Fore.RESET)
+            try:
+                results[symbol] = score_symbol(symbol, news_by_symbol[symbol])
+            except Exception as e:
+                print(Fore.RED + f"Sentiment for {symbol} failed: {e}" + Fore.RESET)
+        return results
+
+    start = time.monotonic()
+    deadline = start + timeout
+    size = batch_size if batch_size and batch_size > 1 and article_cache is None else 1
+    batches = [pending[i:i + size] for i in range(0, len(pending), size)]
+
+    # Enough batches to keep the LLM slots busy while the next ones fetch their news, the others wait in the queue
+    executor = ThreadPoolExecutor(
+        max_workers=min(len(batches), llm_workers + NEWS_FETCH_WORKERS), thread_name_prefix="sentiment"
+    )
+    futures = {}
+    for batch in batches:
+        future = executor.submit(score_batch, batch)
+        futures.update({symbol: future for symbol in batch})
+
+    for symbol, future in futures.items():
+        try:
+            result = future.result(timeout=max(0, deadline - time.monotonic())).get(symbol)
+        except TimeoutError:
+            print(Fore.RED + f"Sentiment for {symbol} timed out after {timeout}s" + Fore.RESET)
+            continue
+        except Exception as e:
+            print(Fore.RED + f"Sentiment for {symbol} failed: {e}" + Fore.RESET)
+            continue
+
+        if result is not None:
+            print(Fore.LIGHTBLUE_EX + f"Sentiment for {symbol}: {result}" + Fore.RESET)
+            sentiments[symbol] = result
+
+    # Do not wait for the symbols that timed out
+    executor.shutdown(wait=False, cancel_futures=True)
+
+    # Report the latency and throughput of the pass, so the per-symbol and the batched modes can be compared
+    eval_tokens = sum(stat["eval_tokens"] for stat in stats)
+    eval_duration = sum(stat["eval_duration"] for stat in stats)
+    print(
+        Fore.CYAN
+        + f"Scored {len(pending)} stocks with {len(stats)} LLM calls (batch size {size}) in {time.monotonic() - start:.1f}s, "
+        + f"{sum(stat['prompt_tokens'] for stat in stats)} prompt tokens, {eval_tokens} eval tokens, "
+        + f"{eval_tokens / eval_duration if eval_duration else 0:.1f} tokens/s"
+        + Fore.RESET
+    )
+    return sentiments
@@ -0,0 +1,213 @@
+import hashlib
+import sqlite3
+import threading
+import time
+
+
+def prompt_hash(template) -> str:
+    """Returns a short hash of the static instruction text of a prompt template."""
+    return hashlib.sha256(template("").encode("utf-8")).hexdigest()[:16]
+
+
+class SentimentCache:
+    """
+    A disk backed cache (SQLite) of the parsed LLM sentiment responses.
+    Entries are keyed by the stock symbol, the news window, the model name and the hash of the prompt template,
+    so rerunning a backtest over the same window does not need to call the LLM again.
+    """
+
+    def __init__(self, path: str = "sentiment_cache.sqlite", max_entries: int = 50_000):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS sentiments (
+                symbol TEXT NOT NULL,
+                start_date TEXT NOT NULL,
+                end_date TEXT NOT NULL,
+                model TEXT NOT NULL,
+                prompt_hash TEXT NOT NULL,
+                sentiment TEXT,
+                score REAL NOT NULL,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (symbol, start_date, end_date, model, prompt_hash)
+            )
+            """
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS sentiments_last_used ON sentiments (last_used)")
+        self.conn.commit()
+
+    def get(self, symbol: str, start_date: str, end_date: str, model: str, *prompt_hashes: str):
+        """
+        Returns the cached response as a dictionary with the keys sentiment and score, or None if it is not cached.
+        With several prompt hashes, the response of the first one that is cached is returned.
+        """
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT prompt_hash, sentiment, score FROM sentiments "
+                "WHERE symbol = ? AND start_date = ? AND end_date = ? AND model = ? "
+                f"AND prompt_hash IN ({', '.join('?' * len(prompt_hashes))})",
+                (symbol, start_date, end_date, model, *prompt_hashes),
+            ).fetchall()
+
+            if not rows:
+                self.misses += 1
+                return None
+            row = min(rows, key=lambda row: prompt_hashes.index(row[0]))
+            key = (symbol, start_date, end_date, model, row[0])
+
+            # Touch the entry so that the eviction drops the least recently used entries first
+            self.conn.execute(
+                "UPDATE sentiments SET last_used = ? "
+                "WHERE symbol = ? AND start_date = ? AND end_date = ? AND model = ? AND prompt_hash = ?",
+                (time.time(), *key),
+            )
+            self.conn.commit()
+            self.hits += 1
+
+        return {"sentiment": row[1], "score": row[2]}
+
+    def put(self, symbol: str, start_date: str, end_date: str, model: str, prompt_hash: str, result: dict):
+        """
+        Stores a parsed response (a dictionary with the keys sentiment and score) and evicts the oldest entries if the
+        cache has grown beyond max_entries.
+        """
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO sentiments VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    symbol,
+                    start_date,
+                    end_date,
+                    model,
+                    prompt_hash,
+                    result.get("sentiment"),
+                    float(result["score"]),
+                    time.time(),
+                ),
+            )
+            self._evict()
+            self.conn.commit()
+
+    def invalidate(self, model: str, *prompt_hashes: str) -> int:
+        """
+        Removes every entry that was not produced by the given model and one of the prompt hashes, i.e. entries that are
+        stale after the prompt or the model has changed. Returns the number of removed entries.
+        """
+        with self.lock:
+            cursor = self.conn.execute(
+                f"DELETE FROM sentiments WHERE model != ? OR prompt_hash NOT IN ({', '.join('?' * len(prompt_hashes))})",
+                (model, *prompt_hashes),
+            )
+            self.conn.commit()
+        return cursor.rowcount
+
+    def clear(self):
+        """Removes every entry and resets the counters."""
+        with self.lock:
+            self.conn.execute("DELETE FROM sentiments")
+            self.conn.commit()
+            self.hits = 0
+            self.misses = 0
+
+    def size(self) -> int:
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM sentiments").fetchone()[0]
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "size": self.size(),
+        }
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def _evict(self):
+        # Must be called while holding the lock
+        overflow = self.conn.execute("SELECT COUNT(*) FROM sentiments").fetchone()[0] - self.max_entries
+        if overflow > 0:
+            self.conn.execute(
+                "DELETE FROM sentiments WHERE rowid IN "
+                "(SELECT rowid FROM sentiments ORDER BY last_used ASC LIMIT ?)",
+                (overflow,),
+            )
+
+
+class ArticleSentimentCache:
+    """
+    A permanent disk backed store (SQLite) of the LLM sentiments of single news articles.
+    Entries are keyed by the content hash of the article (see article_sentiment.article_hash), the model name and the
+    hash of the prompt template, so an article is only ever scored once, whichever news window, rerun or bot it shows
+    up in. Nothing is evicted, an article score is a few dozen bytes.
+    """
+
+    def __init__(self, path: str = "article_cache.sqlite"):
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS articles (
+                article_hash TEXT NOT NULL,
+                model TEXT NOT NULL,
+                prompt_hash TEXT NOT NULL,
+                sentiment TEXT,
+                score REAL NOT NULL,
+                scored_at REAL NOT NULL,
+                PRIMARY KEY (article_hash, model, prompt_hash)
+            )
+            """
+        )
+        self.conn.commit()
+
+    def get(self, article_hash: str, model: str, prompt_hash: str):
+        """Returns the stored score of the article, or None if it was never scored."""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT score FROM articles WHERE article_hash = ? AND model = ? AND prompt_hash = ?",
+                (article_hash, model, prompt_hash),
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return row[0]
+
+    def put(self, article_hash: str, model: str, prompt_hash: str, result: dict):
+        """Stores the parsed response (a dictionary with the keys sentiment and score) of the article."""
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO articles VALUES (?, ?, ?, ?, ?, ?)",
+                (article_hash, model, prompt_hash, result.get("sentiment"), float(result["score"]), time.time()),
+            )
+            self.conn.commit()
+
+    def size(self) -> int:
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM articles").fetchone()[0]
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "size": self.size(),
+        }
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
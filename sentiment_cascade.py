@@ -0,0 +1,175 @@
+import threading
+import hashlib
+import re
+
+# Financial sentiment words, after the Loughran-McDonald word lists, in the forms they usually take in news snippets
+POSITIVE_WORDS = {
+    "beat", "beats", "surge", "surges", "surged", "soar", "soars", "soared", "rally", "rallies", "rallied", "jump",
+    "jumps", "jumped", "gain", "gains", "gained", "rise", "rises", "rose", "climb", "climbs", "climbed", "record",
+    "upgrade", "upgrades", "upgraded", "outperform", "outperforms", "outperformed", "strong", "stronger", "strength",
+    "growth", "grow", "grows", "grew", "profit", "profits", "profitable", "bullish", "optimism", "optimistic", "boost",
+    "boosts", "boosted", "expand", "expands", "expanded", "expansion", "exceed", "exceeds", "exceeded", "raise",
+    "raises", "raised", "buyback", "dividend", "launch", "launches", "launched", "breakthrough", "win", "wins", "won",
+    "approval", "approved", "momentum", "tailwind", "tailwinds", "upside", "robust", "solid", "recover", "recovers",
+    "recovered", "recovery", "positive", "higher", "high", "highs", "improve", "improves", "improved", "success",
+    "successful", "demand", "innovative", "innovation", "leader", "leading", "partnership", "accelerate", "accelerates",
+}
+NEGATIVE_WORDS = {
+    "miss", "misses", "missed", "plunge", "plunges", "plunged", "slump", "slumps", "slumped", "slide", "slides", "slid",
+    "fall", "falls", "fell", "drop", "drops", "dropped", "decline", "declines", "declined", "sink", "sinks", "sank",
+    "tumble", "tumbles", "tumbled", "downgrade", "downgrades", "downgraded", "underperform", "underperforms", "weak",
+    "weaker", "weakness", "loss", "losses", "lose", "loses", "lost", "bearish", "pessimism", "pessimistic", "cut",
+    "cuts", "layoff", "layoffs", "lawsuit", "lawsuits", "probe", "investigation", "fine", "fined", "penalty", "recall",
+    "recalls", "delay", "delays", "delayed", "warn", "warns", "warned", "warning", "risk", "risks", "concern",
+    "concerns", "fear", "fears", "selloff", "sell-off", "headwind", "headwinds", "downside", "lower", "low", "lows",
+    "negative", "slowdown", "slowing", "slow", "antitrust", "ban", "bans", "banned", "tariff", "tariffs", "crash",
+    "crashes", "volatile", "volatility", "uncertainty", "disappoint", "disappoints", "disappointed", "disappointing",
+}
+NEGATIONS = {"not", "no", "never", "without", "despite", "fails", "failed", "didn't", "doesn't", "isn't", "wasn't"}
+
+
+def lexicon_score(news: str, evidence: float = 8.0) -> dict:
+    """
+    Scores the sentiment of the news by counting the financial sentiment words in it, a word within three words after
+    a negation counting for the other side. Returns a dictionary with the keys sentiment, score (-1 to 1, shrunk
+    towards 0 when there are few words) and confidence (0 to 1, growing with the number of sentiment words, reaching
+    0.5 at evidence words).
+    """
+    words = re.findall(r"[a-z][a-z'\-]*", news.lower())
+    positive = negative = 0
+    negated_until = -1
+    for i, word in enumerate(words):
+        if word in NEGATIONS:
+            negated_until = i + 3
+            continue
+        polarity = 1 if word in POSITIVE_WORDS else -1 if word in NEGATIVE_WORDS else 0
+        if polarity and i <= negated_until:
+            polarity = -polarity
+        if polarity > 0:
+            positive += 1
+        elif polarity < 0:
+            negative += 1
+
+    hits = positive + negative
+    score = (positive - negative) / (hits + 2)
+    return {
+        "sentiment": "positive" if score >= 0 else "negative",
+        "score": round(score, 4),
+        "confidence": hits / (hits + evidence),
+    }
+
+
+class SentimentCascade:
+    """
+    The first tier of the sentiment scoring: every news bundle is scored by the lexicon, and only the bundles whose
+    score falls within margin of a decision threshold, or whose confidence is below min_confidence, are escalated to
+    the LLM. A share audit_rate of the other bundles is escalated as well, picked deterministically, so the agreement
+    between the tiers can also be measured on the decisions the lexicon made alone.
+
+    The escalation rate and the agreement of the tiers' trade decisions (buy, hold or sell) are kept in stats, the
+    agreement on the audited bundles being the one that tells whether the lexicon changes the trades.
+    """
+
+    def __init__(
+        self,
+        buy_threshold: float = 0.5,
+        sell_threshold: float = -0.8,
+        margin: float = 0.2,
+        min_confidence: float = 0.6,
+        audit_rate: float = 0.0,
+    ):
+        self.buy_threshold = buy_threshold
+        self.sell_threshold = sell_threshold
+        self.margin = margin
+        self.min_confidence = min_confidence
+        self.audit_rate = audit_rate
+        self.lock = threading.Lock()
+        self.scored = 0
+        self.escalated = 0
+        self.audited = 0
+        self.compared = {"uncertain": 0, "audit": 0}
+        self.agreed = {"uncertain": 0, "audit": 0}
+
+    def decision(self, score: float) -> str:
+        if score >= self.buy_threshold:
+            return "buy"
+        if score <= self.sell_threshold:
+            return "sell"
+        return "hold"
+
+    def is_uncertain(self, result: dict) -> bool:
+        """Returns True if the lexicon result is not confident or too close to a threshold to decide on."""
+        return (
+            result["confidence"] < self.min_confidence
+            or abs(result["score"] - self.buy_threshold) < self.margin
+            or abs(result["score"] - self.sell_threshold) < self.margin
+        )
+
+    def is_audited(self, key: str) -> bool:
+        digest = hashlib.sha256(key.encode("utf-8")).digest()
+        return int.from_bytes(digest[:8], "big") / 2 ** 64 < self.audit_rate
+
+    def score(self, news: str, key: str = ""):
+        """
+        Scores the news with the lexicon. Returns the lexicon result and the reason to escalate the news to the LLM,
+        "uncertain", "audit" or None to keep the lexicon result. The key (e.g. the symbol and the news window) picks
+        the audited bundles.
+        """
+        result = lexicon_score(news)
+        reason = "uncertain" if self.is_uncertain(result) else "audit" if self.is_audited(key) else None
+        with self.lock:
+            self.scored += 1
+            self.escalated += reason == "uncertain"
+            self.audited += reason == "audit"
+        return result, reason
+
+    def compare(self, lexicon_result: dict, llm_result: dict, reason: str):
+        """Records whether the lexicon and the LLM lead to the same trade decision on an escalated bundle."""
+        with self.lock:
+            self.compared[reason] += 1
+            self.agreed[reason] += self.decision(lexicon_result["score"]) == self.decision(llm_result["score"])
+
+    def settings(self) -> dict:
+        """Returns the arguments to build the same cascade, e.g. in a worker process."""
+        return {
+            "buy_threshold": self.buy_threshold,
+            "sell_threshold": self.sell_threshold,
+            "margin": self.margin,
+            "min_confidence": self.min_confidence,
+            "audit_rate": self.audit_rate,
+        }
+
+    def counters(self) -> dict:
+        with self.lock:
+            return {
+                "scored": self.scored,
+                "escalated": self.escalated,
+                "audited": self.audited,
+                "compared": dict(self.compared),
+                "agreed": dict(self.agreed),
+            }
+
+    def merge(self, counters: dict):
+        """Adds the counters of another cascade with the same settings, e.g. one that ran in a worker process."""
+        with self.lock:
+            self.scored += counters["scored"]
+            self.escalated += counters["escalated"]
+            self.audited += counters["audited"]
+            for reason in self.compared:
+                self.compared[reason] += counters["compared"][reason]
+                self.agreed[reason] += counters["agreed"][reason]
+
+    def stats(self) -> dict:
+        with self.lock:
+            agreement = {
+                reason: self.agreed[reason] / self.compared[reason] if self.compared[reason] else None
+                for reason in self.compared
+            }
+            return {
+                "scored": self.scored,
+                "escalated": self.escalated,
+                "audited": self.audited,
+                "escalation_rate": self.escalated / self.scored if self.scored else 0.0,
+                "agreement_uncertain": agreement["uncertain"],
+                "agreement_audited": agreement["audit"],
+            }
@@ -0,0 +1,157 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed, wait
+from colorama import Fore
+import multiprocessing
+import time
+import os
+
+import llmprompts
+from rate_limit import TokenBucket
+from sentiment import LLM_CALL_TIMEOUT, MODEL, SentimentEngine, get_sentiments, ollama_capacity
+from sentiment_cache import ArticleSentimentCache, SentimentCache
+from sentiment_cascade import SentimentCascade
+
+# Set in every worker process by _init_worker
+_options = None
+_cache = None
+_article_cache = None
+_engine = None
+
+
+def _init_worker(limiter: TokenBucket, options: dict):
+    # Runs once per worker process: share the news rate limiter, open the caches and load the model
+    global _options, _cache, _article_cache, _engine
+    llmprompts.news_rate_limiter = limiter
+    _options = options
+    _cache = SentimentCache(options["cache_path"]) if options["cache_path"] else None
+    _article_cache = ArticleSentimentCache(options["article_cache_path"]) if options["article_cache_path"] else None
+    _engine = SentimentEngine(
+        options["model"], keep_alive=options["keep_alive"], timeout=options["llm_call_timeout"], hosts=options["hosts"]
+    )
+    try:
+        _engine.warm()
+    except Exception as e:
+        print(Fore.YELLOW + f"Warming up {options['model']} failed: {e}" + Fore.RESET)
+
+
+def _ready() -> int:
+    # Keeps a worker busy for a moment, so that every submitted call starts its own worker process
+    time.sleep(0.1)
+    return os.getpid()
+
+
+def _release():
+    # The keep_alive of a model is kept by the server, so releasing it from one worker releases it for all of them
+    _engine.release()
+
+
+def _score_shard(symbols: list, news_start_date: str, news_end_date: str):
+    # A cascade per shard, whose counters are sent back with the sentiments and merged in the main process
+    cascade = SentimentCascade(**_options["cascade"]) if _options["cascade"] else None
+    sentiments = get_sentiments(
+        symbols,
+        news_start_date=news_start_date,
+        news_end_date=news_end_date,
+        model=_options["model"],
+        engine=_engine,
+        cache=_cache,
+        llm_workers=_options["llm_workers"],
+        timeout=_options["timeout"],
+        batch_size=_options["batch_size"],
+        token_budget=_options["token_budget"],
+        article_cache=_article_cache,
+        cascade=cascade,
+    )
+    return sentiments, cascade.counters() if cascade is not None else None
+
+
+class SentimentWorkerPool:
+    """
+    Scores the sentiments of a large universe of stocks on a pool of worker processes. The symbols are split into
+    shards of shard_size that the workers take from a shared queue as they become free, every worker scoring its shard
+    with get_sentiments. The news API calls of all the workers go through one token bucket of news_rate calls per
+    second (bursts of up to news_burst), and the parallel slots of the Ollama servers are split between the workers.
+    Every worker has its own SentimentEngine over the Ollama servers of hosts (defaults to ollama_hosts), with the
+    given per-call timeout and keep_alive; the model is released when the pool is closed.
+    With a cascade (see sentiment_cascade.SentimentCascade), the workers score the news with the same lexicon first,
+    and their escalation and agreement counters are added to the cascade.
+
+    The workers are started once and kept for the whole run, so they only import and warm up once.
+    """
+
+    def __init__(
+        self,
+        processes: int,
+        shard_size: int = 8,
+        news_rate: float = None,
+        news_burst: float = None,
+        model: str = MODEL,
+        cache_path: str = None,
+        article_cache_path: str = None,
+        llm_workers: int = None,
+        timeout: float = 300,
+        batch_size: int = None,
+        token_budget: int = None,
+        hosts: list = None,
+        llm_call_timeout: float = LLM_CALL_TIMEOUT,
+        keep_alive=-1,
+        cascade: SentimentCascade = None,
+    ):
+        context = multiprocessing.get_context("spawn")
+        self.processes = processes
+        self.shard_size = shard_size
+        self.cascade = cascade
+        self.limiter = TokenBucket(news_rate, news_burst, context=context) if news_rate else None
+        options = {
+            "model": model,
+            "cache_path": cache_path,
+            "article_cache_path": article_cache_path,
+            "llm_workers": llm_workers or max(1, ollama_capacity() // processes),
+            "timeout": timeout,
+            "batch_size": batch_size,
+            "token_budget": token_budget,
+            "hosts": hosts,
+            "llm_call_timeout": llm_call_timeout,
+            "keep_alive": keep_alive,
+            "cascade": cascade.settings() if cascade is not None else None,
+        }
+        self.executor = ProcessPoolExecutor(
+            max_workers=processes,
+            mp_context=context,
+            initializer=_init_worker,
+            initargs=(self.limiter, options),
+        )
+
+    def start(self):
+        """Starts all the worker processes up front, as they are otherwise started on demand during the first pass."""
+        wait([self.executor.submit(_ready) for _ in range(self.processes)])
+        return self
+
+    def score(self, symbols: list, news_start_date: str, news_end_date: str) -> dict:
+        """Returns the sentiments of the symbols, a dictionary of symbol to the parsed response, like get_sentiments."""
+        shards = [symbols[i:i + self.shard_size] for i in range(0, len(symbols), self.shard_size)]
+        futures = {
+            self.executor.submit(_score_shard, shard, news_start_date, news_end_date): shard for shard in shards
+        }
+
+        sentiments = {}
+        for future in as_completed(futures):
+            try:
+                results, counters = future.result()
+            except Exception as e:
+                print(Fore.RED + f"Sentiments of {futures[future]} failed: {e}" + Fore.RESET)
+                continue
+
+            sentiments.update(results)
+            if counters is not None:
+                self.cascade.merge(counters)
+        return sentiments
+
+    def stats(self) -> dict:
+        return {"processes": self.processes, "news_rate_limiter": self.limiter.stats() if self.limiter else None}
+
+    def close(self):
+        try:
+            self.executor.submit(_release).result()
+        except Exception as e:
+            print(Fore.YELLOW + f"Releasing the model failed: {e}" + Fore.RESET)
+        self.executor.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,116 @@
+from datetime import datetime, timedelta
+from colorama import Fore
+from bisect import bisect_right
+import threading
+import sqlite3
+
+import yfinance as yf
+
+
+def fetch_shares_history(symbol: str, start_date: str, end_date: str) -> list:
+    """
+    Fetches the historical shares outstanding of the stock from Yahoo Finance, returns a list of (date, shares) with
+    one entry per day on which the count changed.
+    """
+    series = yf.Ticker(symbol).get_shares_full(start=start_date, end=end_date)
+    if series is None or len(series) == 0:
+        return []
+
+    # Yahoo can report several counts on the same day, keep the last one
+    series = series.groupby(series.index.strftime("%Y-%m-%d")).last()
+    return [(date, float(shares)) for date, shares in series.items()]
+
+
+class SharesStore:
+    """
+    A local store (SQLite) of the historical shares outstanding of stocks, with a point-in-time lookup, so the market
+    caps of a backtest use the share counts at the backtest date instead of today's counts.
+    """
+
+    def __init__(self, path: str = "shares_store.sqlite"):
+        self.path = path
+        self.lock = threading.Lock()
+        self.history = {}
+
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS shares (
+                symbol TEXT NOT NULL,
+                date TEXT NOT NULL,
+                shares REAL NOT NULL,
+                PRIMARY KEY (symbol, date)
+            )
+            """
+        )
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS loads (
+                symbol TEXT NOT NULL,
+                start_date TEXT NOT NULL,
+                end_date TEXT NOT NULL
+            )
+            """
+        )
+        self.conn.commit()
+
+    def load(self, symbols: list, start_date: datetime, end_date: datetime, lookback_days: int = 365, fetcher=None):
+        """
+        Loads the shares outstanding of the symbols between start_date and end_date into memory, fetching only the
+        symbols that were never loaded over that period. The load reaches lookback_days before start_date, as the
+        share counts are only reported every few months. A symbol whose fetch fails or returns nothing is left out and
+        fetched again by the next load.
+        """
+        fetcher = fetcher or fetch_shares_history
+        start = (start_date - timedelta(days=lookback_days)).strftime("%Y-%m-%d")
+        end = end_date.strftime("%Y-%m-%d")
+
+        with self.lock:
+            for symbol in symbols:
+                covered = self.conn.execute(
+                    "SELECT 1 FROM loads WHERE symbol = ? AND start_date <= ? AND end_date >= ?",
+                    (symbol, start, end),
+                ).fetchone()
+                if covered:
+                    continue
+
+                print(Fore.CYAN + f"Loading the shares outstanding of {symbol} from {start} to {end}" + Fore.RESET)
+                try:
+                    history = fetcher(symbol, start, end)
+                except Exception as e:
+                    print(Fore.RED + f"Loading the shares outstanding of {symbol} failed: {e}" + Fore.RESET)
+                    continue
+                if not history:
+                    # Not recorded as loaded, so that the next load tries again
+                    print(Fore.YELLOW + f"No shares outstanding found for {symbol}" + Fore.RESET)
+                    continue
+
+                self.conn.executemany(
+                    "INSERT OR REPLACE INTO shares VALUES (?, ?, ?)",
+                    [(symbol, date, shares) for date, shares in history],
+                )
+                self.conn.execute("INSERT INTO loads VALUES (?, ?, ?)", (symbol, start, end))
+            self.conn.commit()
+
+            for symbol in symbols:
+                rows = self.conn.execute(
+                    "SELECT date, shares FROM shares WHERE symbol = ? ORDER BY date", (symbol,)
+                ).fetchall()
+                self.history[symbol] = ([row[0] for row in rows], [row[1] for row in rows])
+
+    def shares_as_of(self, symbol: str, date: str):
+        """
+        Returns the latest shares outstanding of the stock reported at or before the date (YYYY-MM-DD), from memory.
+        If the date is before the first known report, the earliest known count is used. Returns None if the stock
+        has no known share count.
+        """
+        dates, shares = self.history.get(symbol, ([], []))
+        if not dates:
+            return None
+
+        i = bisect_right(dates, date)
+        return shares[i - 1] if i > 0 else shares[0]
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
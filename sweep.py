@@ -0,0 +1,219 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, timedelta
+from colorama import Fore
+import importlib.util
+import itertools
+import argparse
+import random
+import json
+import os
+
+import pandas as pd
+import yfinance as yf
+
+from precompute_sentiments import MAG7
+from shares_store import SharesStore
+
+BOT_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "2_llm_sentiment_trading_bot.py")
+
+# Example search space, every key is a parameter of Mag7SentimentBot
+DEFAULT_SPACE = {
+    "buy_threshold": [0.25, 0.5, 0.75],
+    "sell_threshold": [-0.6, -0.8],
+    "initial_allocation": [0.25, 0.5],
+    "cash_at_risk": [0.025, 0.05],
+}
+
+
+def grid(space: dict) -> list:
+    """Returns every combination of the values of the search space."""
+    keys = list(space)
+    return [dict(zip(keys, values)) for values in itertools.product(*(space[key] for key in keys))]
+
+
+def random_search(space: dict, n: int, seed: int = None) -> list:
+    """
+    Returns n random configurations of the search space. A list of values is sampled as a choice, and a pair of
+    numbers given as {"low": ..., "high": ...} is sampled uniformly.
+    """
+    rng = random.Random(seed)
+    configs = []
+    for _ in range(n):
+        config = {}
+        for key, values in space.items():
+            if isinstance(values, dict):
+                config[key] = rng.uniform(values["low"], values["high"])
+            else:
+                config[key] = rng.choice(values)
+        configs.append(config)
+    return configs
+
+
+def load_bot_class():
+    """Imports Mag7SentimentBot from the bot script, whose file name is not a valid module name."""
+    spec = importlib.util.spec_from_file_location("llm_sentiment_trading_bot", BOT_FILE)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.Mag7SentimentBot
+
+
+def fetch_prices(symbols: list, start_date: datetime, end_date: datetime, prices_dir: str = "prices") -> str:
+    """
+    Downloads the daily prices of the symbols once into prices_dir (one Parquet file per symbol), so the backtests of
+    the sweep read them from disk instead of every run fetching them again. Returns prices_dir.
+    """
+    os.makedirs(prices_dir, exist_ok=True)
+    for symbol in symbols:
+        path = os.path.join(prices_dir, f"{symbol}.parquet")
+        if os.path.exists(path):
+            continue
+
+        df = yf.Ticker(symbol).history(start=start_date, end=end_date, interval="1d", auto_adjust=False)
+        df = df.rename(columns=str.lower)[["open", "high", "low", "close", "volume"]]
+        df.to_parquet(path)
+        print(Fore.CYAN + f"Saved the prices of {symbol} to {path}" + Fore.RESET)
+    return prices_dir
+
+
+def load_prices(prices_dir: str, symbols: list) -> dict:
+    """Loads the daily prices saved by fetch_prices, returns a dictionary of symbol to DataFrame."""
+    return {symbol: pd.read_parquet(os.path.join(prices_dir, f"{symbol}.parquet")) for symbol in symbols}
+
+
+def build_pandas_data(prices: dict) -> dict:
+    """Wraps the daily prices of every symbol for lumibot's PandasDataBacktesting."""
+    from lumibot.entities import Asset, Data
+
+    quote = Asset(symbol="USD", asset_type=Asset.AssetType.FOREX)
+    pandas_data = {}
+    for symbol, df in prices.items():
+        asset = Asset(symbol=symbol, asset_type=Asset.AssetType.STOCK)
+        pandas_data[(asset, quote)] = Data(asset, df, timestep="day", quote=quote)
+    return pandas_data
+
+
+def run_backtest(bot_class, pandas_data: dict, parameters: dict, start_date: datetime, end_date: datetime):
+    """Runs a quiet lumibot backtest of the bot over the given prices, returns the results and the strategy."""
+    from lumibot.backtesting import PandasDataBacktesting
+
+    return bot_class.run_backtest(
+        PandasDataBacktesting,
+        start_date,
+        end_date,
+        pandas_data=pandas_data,
+        parameters=parameters,
+        benchmark_asset=None,
+        show_plot=False,
+        show_tearsheet=False,
+        save_tearsheet=False,
+        show_indicators=False,
+        show_progress_bar=False,
+        quiet_logs=True,
+    )
+
+
+_bot_class = None
+_pandas_data = None
+
+
+def _init_worker(prices_dir: str, symbols: list):
+    # Runs once per worker process: import the bot and load the shared prices, instead of once per backtest.
+    global _bot_class, _pandas_data
+
+    _bot_class = load_bot_class()
+    _pandas_data = build_pandas_data(load_prices(prices_dir, symbols))
+
+
+def _run(config: dict, start_date: datetime, end_date: datetime, sentiment_table: str) -> dict:
+    results, strategy = run_backtest(
+        _bot_class,
+        _pandas_data,
+        {**config, "sentiment_table": sentiment_table},
+        start_date,
+        end_date,
+    )
+    return {
+        **config,
+        "cagr": results.get("cagr"),
+        "max_drawdown": (results.get("max_drawdown") or {}).get("drawdown"),
+        "sharpe": results.get("sharpe"),
+        "trade_count": strategy.trade_count,
+    }
+
+
+def sweep(
+    configs: list,
+    start_date: datetime,
+    end_date: datetime,
+    sentiment_table: str = "sentiments.parquet",
+    out: str = "sweep_results.csv",
+    processes: int = None,
+    prices_dir: str = "prices",
+    symbols: list = MAG7,
+) -> pd.DataFrame:
+    """
+    Backtests every configuration in a process pool and writes one summary row per configuration (CAGR, max drawdown,
+    Sharpe and trade count) to the results table at out. The prices and the shares outstanding are fetched once
+    before the pool starts, and the sentiments come from the precomputed sentiment table.
+    """
+    fetch_prices(symbols, start_date - timedelta(days=14), end_date + timedelta(days=1), prices_dir)
+    shares_store = SharesStore()
+    shares_store.load(symbols, start_date - timedelta(days=7), end_date + timedelta(days=7))
+    shares_store.close()
+
+    rows = []
+    with ProcessPoolExecutor(
+        max_workers=processes or os.cpu_count(),
+        initializer=_init_worker,
+        initargs=(prices_dir, symbols),
+    ) as executor:
+        futures = {executor.submit(_run, config, start_date, end_date, sentiment_table): config for config in configs}
+        for future in as_completed(futures):
+            try:
+                row = future.result()
+            except Exception as e:
+                print(Fore.RED + f"Backtest of {futures[future]} failed: {e}" + Fore.RESET)
+                continue
+
+            rows.append(row)
+            print(Fore.GREEN + f"[{len(rows)}/{len(configs)}] {row}" + Fore.RESET)
+
+            # Save the results as they come in, so an interrupted sweep keeps what has been done
+            pd.DataFrame(rows).to_csv(out, index=False)
+
+    results = pd.DataFrame(rows)
+    if len(results):
+        results = results.sort_values("cagr", ascending=False)
+        results.to_csv(out, index=False)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Parameter sweep of the Mag7SentimentBot backtests.")
+    parser.add_argument("--start", required=True, help="backtesting start date, YYYY-MM-DD")
+    parser.add_argument("--end", required=True, help="backtesting end date, YYYY-MM-DD")
+    parser.add_argument("--space", help="JSON file of the search space, defaults to DEFAULT_SPACE")
+    parser.add_argument("--random", type=int, help="number of random configurations instead of the full grid")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--sentiment-table", default="sentiments.parquet")
+    parser.add_argument("--out", default="sweep_results.csv")
+    parser.add_argument("--processes", type=int, default=None)
+    args = parser.parse_args()
+
+    space = DEFAULT_SPACE
+    if args.space:
+        with open(args.space) as f:
+            space = json.load(f)
+
+    configs = random_search(space, args.random, args.seed) if args.random else grid(space)
+    print(Fore.CYAN + f"Sweeping {len(configs)} configurations" + Fore.RESET)
+
+    results = sweep(
+        configs,
+        datetime.strptime(args.start, "%Y-%m-%d"),
+        datetime.strptime(args.end, "%Y-%m-%d"),
+        sentiment_table=args.sentiment_table,
+        out=args.out,
+        processes=args.processes,
+    )
+    print(results.head(10).to_string(index=False))
@@ -0,0 +1,77 @@
+from datetime import datetime
+import os
+
+import pandas_market_calendars as mcal
+import numpy as np
+import pandas as pd
+
+from benchmark import synthetic_prices
+from fast_backtest import parity_check, weekly_bars
+from precompute_sentiments import COLUMNS, MAG7, save_table, weekly_windows
+from shares_store import SharesStore
+
+START_DATE = datetime(2024, 1, 2)
+END_DATE = datetime(2024, 4, 29)
+
+
+def session_prices(symbols: list, seed: int = 0) -> dict:
+    """Synthetic daily prices on the NYSE sessions only, as the downloaded prices have no rows on market holidays."""
+    start, end = datetime(2023, 12, 1), datetime(2024, 5, 31)
+    sessions = mcal.get_calendar("NYSE").valid_days(start_date=start, end_date=end).tz_localize(None)
+    return {
+        symbol: df[df.index.normalize().tz_localize(None).isin(sessions)].copy()
+        for symbol, df in synthetic_prices(symbols, start, end, seed).items()
+    }
+
+
+def write_inputs(directory: str, seed: int = 0):
+    """
+    Writes synthetic daily prices on the NYSE sessions, a random sentiment table of the weeks precompute_sentiments
+    computes and flat share counts for the lumibot backtest.
+    """
+    rng = np.random.default_rng(seed)
+    os.makedirs(os.path.join(directory, "prices"))
+    for symbol, df in session_prices(MAG7, seed).items():
+        # Open away from the close, so the orders are sized and filled at different prices as in the real data
+        df["open"] = df["close"] * np.exp(rng.normal(0, 0.005, len(df)))
+        df.to_parquet(os.path.join(directory, "prices", f"{symbol}.parquet"))
+
+    rows = [
+        (today, symbol, day_prior, today, "", float(rng.uniform(-1, 1)), "synthetic")
+        for day_prior, today in weekly_windows(START_DATE, END_DATE)
+        for symbol in MAG7
+    ]
+    save_table(pd.DataFrame(rows, columns=COLUMNS), os.path.join(directory, "sentiments.parquet"))
+
+    shares_store = SharesStore(os.path.join(directory, "shares_store.sqlite"))
+    shares_store.load(
+        MAG7, START_DATE, END_DATE, fetcher=lambda symbol, start, end: [(start, 1e9 * (1 + MAG7.index(symbol)))]
+    )
+    shares_store.close()
+
+
+def test_weekly_bars_start_after_start_date():
+    prices = synthetic_prices(["SPY"], datetime(2023, 12, 1), datetime(2024, 2, 1))
+    dates, close, open_ = weekly_bars(prices, START_DATE, datetime(2024, 1, 31))
+    assert dates[0] == pd.Timestamp("2024-01-03")
+    assert [date.isocalendar()[1] for date in dates] == [1, 2, 3, 4, 5]
+    assert close.shape == open_.shape == (5, 1)
+
+
+def test_weekly_windows_match_weekly_bars():
+    dates, _, _ = weekly_bars(session_prices(["SPY"]), START_DATE, END_DATE)
+    assert [today for _, today in weekly_windows(START_DATE, END_DATE)] == [date.strftime("%Y-%m-%d") for date in dates]
+
+
+def test_parity_check_matches_lumibot_week_by_week(tmp_path, monkeypatch):
+    write_inputs(str(tmp_path))
+    monkeypatch.chdir(tmp_path)  # lumibot writes its logs to the working directory
+    assert parity_check(
+        START_DATE,
+        END_DATE,
+        sentiment_table="sentiments.parquet",
+        prices_dir="prices",
+        shares_path="shares_store.sqlite",
+        cash_at_risk=0.3,
+        buy_threshold=0.2,
+    )
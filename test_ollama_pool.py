@@ -0,0 +1,33 @@
+from fake_servers import FakeOllama
+from ollama_pool import OllamaPool
+
+
+def chat(pool: OllamaPool):
+    return pool.chat(model="qwen2.5:14b", messages=[{"role": "user", "content": "news"}])
+
+
+def test_slow_endpoint_within_deadline_succeeds_with_a_second_endpoint():
+    servers = [FakeOllama(latency=1.5).start() for _ in range(2)]
+    pool = OllamaPool([server.url for server in servers], timeout=2.0, health_interval=None)
+    try:
+        assert chat(pool)["message"]["content"]
+        stats = pool.stats()
+        assert stats["failovers"] == 0
+        assert all(endpoint["timeouts"] == 0 and endpoint["healthy"] for endpoint in stats["endpoints"])
+    finally:
+        pool.close()
+        for server in servers:
+            server.stop()
+
+
+def test_failed_endpoint_fails_over():
+    servers = [FakeOllama(failure_rate=1.0).start(), FakeOllama(latency=0.1).start()]
+    pool = OllamaPool([server.url for server in servers], timeout=2.0, health_interval=None)
+    try:
+        for _ in range(4):
+            assert chat(pool)["message"]["content"]
+        assert pool.stats()["failovers"] >= 1
+    finally:
+        pool.close()
+        for server in servers:
+            server.stop()
@@ -0,0 +1,34 @@
+import importlib.util
+import os
+
+from fast_backtest import weekly_bars
+from sweep import build_pandas_data, run_backtest
+from test_fast_backtest import END_DATE, START_DATE, session_prices
+
+
+def load_weekly_random_bot():
+    """Imports WeeklyRandomBot from the bot script, and makes it hold every week and remember the days it decided on."""
+    spec = importlib.util.spec_from_file_location(
+        "random_trading_bot", os.path.join(os.path.dirname(__file__), "0_random_trading_bot.py")
+    )
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+
+    class HoldingBot(module.WeeklyRandomBot):
+        def decide_action(self):
+            self.decision_days = getattr(self, "decision_days", []) + [self.get_datetime().date()]
+            return "hold"
+
+    return HoldingBot
+
+
+def test_weekly_random_bot_wakes_up_twice_a_week_in_pandas_backtests(tmp_path, monkeypatch):
+    # Pins the lumibot internals WeeklyCadence moves the clock with, see requirements.txt
+    monkeypatch.chdir(tmp_path)  # lumibot writes its logs to the working directory
+    prices = session_prices(["SPY"])
+    _, strategy = run_backtest(load_weekly_random_bot(), build_pandas_data(prices), {}, START_DATE, END_DATE)
+
+    dates, _, _ = weekly_bars(prices, START_DATE, END_DATE)
+    assert strategy.decision_days == [date.date() for date in dates]
+    # Every week, the trading day and the next one, which moves the clock to the next week instead of every day
+    assert strategy.wakeups == 2 * len(dates)
@@ -0,0 +1,39 @@
+import csv
+import os
+
+MAG7 = ["AAPL", "MSFT", "GOOGL", "AMZN", "META", "NVDA", "TSLA"]
+
+# Column names of the symbols in the index files published by the usual sources (e.g. the S&P 500 constituents CSV)
+SYMBOL_COLUMNS = ("symbol", "ticker", "code")
+
+
+def load_universe(universe=None) -> list:
+    """
+    Returns the list of stock symbols to trade. The universe is either a list of symbols, a comma separated string of
+    symbols, or the path of an index file: a text file with one symbol per line, or a CSV file with a Symbol (or
+    Ticker) column. Defaults to the Magnificent 7. The duplicates are dropped, the order is kept.
+    """
+    if universe is None:
+        symbols = MAG7
+    elif isinstance(universe, (list, tuple)):
+        symbols = universe
+    elif os.path.exists(universe):
+        symbols = read_index_file(universe)
+    else:
+        symbols = universe.split(",")
+
+    # Yahoo writes the share classes with a dash, e.g. BRK-B for BRK.B
+    symbols = [symbol.strip().upper().replace(".", "-") for symbol in symbols if symbol and symbol.strip()]
+    return list(dict.fromkeys(symbols))
+
+
+def read_index_file(path: str) -> list:
+    with open(path, newline="") as f:
+        if not path.lower().endswith(".csv"):
+            return [line.split("#")[0].strip() for line in f]
+
+        reader = csv.DictReader(f)
+        column = next((name for name in reader.fieldnames or [] if name.strip().lower() in SYMBOL_COLUMNS), None)
+        if column is None:
+            raise ValueError(f"No symbol column in {path}, expected one of {SYMBOL_COLUMNS}")
+        return [row[column] for row in reader]
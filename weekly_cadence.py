@@ -0,0 +1,113 @@
+from datetime import date, timedelta
+from colorama import Fore
+from bisect import bisect_right
+
+import pandas_market_calendars as mcal
+import pandas as pd
+
+
+class WeeklyCadence:
+    """
+    A mixin for the Strategy subclasses that trade once a week. It keys the weeks by (ISO year, ISO week), so the
+    weeks do not collide across year boundaries, and it uses the exchange trading calendar to sleep from the first
+    trading session of a week until the first trading session of the next week, holidays included, instead of
+    waking up every day only to return.
+
+    Lumibot's backtests run every trading session whatever the sleeptime, so in a backtest the mixin moves the clock
+    itself: a pure pandas daily backtest steps through the dates of its data, and is moved to the next week's first
+    session on the wakeup after the trades, once their orders are filled at the open, while the other backtests are
+    put to sleep after the close until that session. The pure pandas path moves lumibot's private date iterator, so
+    lumibot is pinned in requirements.txt and test_weekly_cadence.py checks the wakeups of a backtest.
+
+    Call init_weekly_cadence in initialize, and return early from on_trading_iteration when is_new_trading_week is False.
+    """
+
+    def init_weekly_cadence(self, calendar_name: str = "NYSE"):
+        self.last_trade_week = None
+        self.wakeups = 0
+        self.early_returns = 0
+        self.first_wakeup = None
+        self.last_wakeup = None
+        self.next_wakeup = None
+
+        self.trading_calendar = mcal.get_calendar(calendar_name)
+        self.sessions = []
+        self._load_sessions(self.get_datetime().date())
+
+    def _load_sessions(self, day: date):
+        # Load about a year of trading sessions at a time, starting a week before the given day
+        start = day - timedelta(days=7)
+        days = self.trading_calendar.valid_days(start_date=start, end_date=day + timedelta(days=400))
+        self.sessions = [session.date() for session in days]
+
+    def next_week_first_session(self, day: date):
+        """Returns the first trading session of the first week after the week of the day."""
+        week = day.isocalendar()[:2]
+        while True:
+            if not self.sessions or day >= self.sessions[-1] - timedelta(days=14):
+                self._load_sessions(day)
+            for session in self.sessions[bisect_right(self.sessions, day):]:
+                if session.isocalendar()[:2] != week:
+                    return session
+            day = self.sessions[-1]
+
+    def is_new_trading_week(self) -> bool:
+        """
+        Returns True on the first wakeup of a new (ISO year, ISO week), and schedules the next wakeup on the first
+        trading session of the next week. Returns False on any other wakeup.
+        """
+        today = self.get_datetime().date()
+        self.wakeups += 1
+        self.first_wakeup = self.first_wakeup or today
+        self.last_wakeup = today
+
+        week = today.isocalendar()[:2]
+        if week == self.last_trade_week:
+            self.early_returns += 1
+            if self.next_wakeup is not None and self.is_backtesting and self._executor._is_pandas_daily_data_source():
+                self._skip_to_next_wakeup()
+            return False
+
+        self.last_trade_week = week
+        self.next_wakeup = self.next_week_first_session(today)
+        self.sleeptime = f"{(self.next_wakeup - today).days}D"
+        return True
+
+    def _skip_to_next_wakeup(self):
+        # The pure pandas daily backtests take the next date of the data after the one at _iter_count, which nothing
+        # else reads. They only run on the dates of the data, so go to its first date in the week of the next wakeup,
+        # and still visit the last date of the backtest, so that the portfolio is valued at the end
+        data_source = self.broker.data_source
+        dates = data_source._date_index
+        week_start = self.next_wakeup - timedelta(days=self.next_wakeup.weekday())
+        position = dates.searchsorted(pd.Timestamp(week_start).tz_localize(dates.tz))
+        last = dates.searchsorted(pd.Timestamp(data_source.datetime_end).tz_convert(dates.tz)) - 1
+        data_source._iter_count = max(min(position, last) - 1, data_source._iter_count)
+        self.next_wakeup = None
+
+    def after_market_closes(self):
+        # The other backtests go on with the next trading session after the close, sleep until the next wakeup instead
+        if self.next_wakeup is not None and self.is_backtesting and not self._executor._is_pandas_daily_data_source():
+            now = self.get_datetime()
+            midnight = now.replace(hour=0, minute=0, second=0, microsecond=0)
+            seconds = (self.next_wakeup - now.date()).days * 86400 - (now - midnight).total_seconds()
+            self.next_wakeup = None
+            if seconds > 0:
+                self.sleep(seconds)
+        super().after_market_closes()
+
+    def skipped_iterations(self) -> int:
+        """Returns the number of trading sessions the strategy did not have to wake up on."""
+        if self.first_wakeup is None:
+            return 0
+        sessions = len(self.trading_calendar.valid_days(start_date=self.first_wakeup, end_date=self.last_wakeup))
+        return max(sessions - self.wakeups, 0)
+
+    def on_strategy_end(self):
+        print(
+            Fore.CYAN
+            + f"Weekly cadence: {self.wakeups} wakeups, {self.skipped_iterations()} trading sessions skipped, "
+            + f"{self.early_returns} wakeups returned early"
+            + Fore.RESET
+        )
+        super().on_strategy_end()